@@ -0,0 +1,149 @@
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from config import MEDIA_DIR, MEDIA_CACHE_MAX_BYTES, AUDIO_WORKERS
+from metrics import TTS_SECONDS
+
+# Voice notes are stored as <sha256 of (text, lang, codec)>.ogg, so identical
+# verse text is synthesized and encoded once and concurrent renders never
+# share a file name.
+CODEC = "opus"
+EXTENSION = ".ogg"
+# render_many runs while the delivery engine's threads are busy, and forking a
+# threaded process can copy a lock some other thread holds; workers come from
+# a clean forkserver (spawn where there is none) instead
+START_METHOD = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+EVICT_EVERY = 50 # Scan the media directory for eviction every N renders, not on every one
+_renders_since_evict = 0
+_evict_lock = threading.Lock()
+
+def audio_key(text, lang="en", codec=CODEC):
+    return hashlib.sha256(f"{codec}\0{lang}\0{text}".encode("utf-8")).hexdigest()
+
+def media_path(key):
+    return os.path.join(MEDIA_DIR, key + EXTENSION)
+
+def _synthesize(text, lang, codec):
+    # gTTS -> MP3 -> OGG/Opus, all in memory
+    from gtts import gTTS
+    from pydub import AudioSegment
+    mp3 = BytesIO()
+    gTTS(text=text, lang=lang, slow=False).write_to_fp(mp3)
+    mp3.seek(0)
+    ogg = BytesIO()
+    AudioSegment.from_file(mp3, format="mp3").export(ogg, format="ogg", codec=codec)
+    return ogg.getvalue()
+
+def render_audio(text, lang="en", codec=CODEC):
+    # Returns the path of the rendered file, rendering it only on a cache miss
+    key = audio_key(text, lang, codec)
+    path = media_path(key)
+    try:
+        os.utime(path) # Mark as recently used for eviction
+        return path
+    except FileNotFoundError:
+        pass # Not rendered yet, or evicted since
+    with TTS_SECONDS.time():
+        data = _synthesize(text, lang, codec)
+    os.makedirs(MEDIA_DIR, exist_ok=True)
+    # Write to a unique temp file and rename, so readers never see a partial file
+    fd, tmp_path = tempfile.mkstemp(dir=MEDIA_DIR, suffix=".part")
+    with os.fdopen(fd, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+    _note_render()
+    return path
+
+def _note_render():
+    global _renders_since_evict
+    with _evict_lock:
+        _renders_since_evict += 1
+        if _renders_since_evict < EVICT_EVERY:
+            return
+        _renders_since_evict = 0
+    evict_media()
+
+def evict_media(max_bytes=MEDIA_CACHE_MAX_BYTES):
+    # Drop least recently used renders until the cache fits
+    try:
+        entries = [entry for entry in os.scandir(MEDIA_DIR) if entry.name.endswith(EXTENSION)]
+    except FileNotFoundError:
+        return 0
+    stats = []
+    for entry in entries:
+        try:
+            info = entry.stat()
+        except FileNotFoundError:
+            continue # Evicted by another worker mid-scan
+        stats.append((info.st_mtime, info.st_size, entry.path))
+    total = sum(size for _, size, _ in stats)
+    removed = 0
+    for _, size, path in sorted(stats):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+            removed += 1
+        except FileNotFoundError:
+            pass # Another worker got there first
+    return removed
+
+def _render_in_worker(args):
+    # Returns (path or None, seconds); the parent records the timing, since
+    # metrics observed in a pool process are lost with it
+    text, lang, codec = args
+    started = time.perf_counter()
+    try:
+        return render_audio(text, lang, codec), time.perf_counter() - started
+    except Exception as e:
+        print(f"Error generating voice note: {e}")
+        return None, time.perf_counter() - started
+
+def _get_pool(workers):
+    # One pool per process, started on first use and kept for every later
+    # chunk and bucket, so worker start-up (imports, forkserver) is paid once
+    global _pool, _pool_pid
+    with _pool_lock:
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(START_METHOD))
+            _pool_pid = os.getpid()
+        return _pool
+
+def _drop_pool(pool):
+    global _pool
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+def render_many(texts, lang="en", codec=CODEC, workers=AUDIO_WORKERS):
+    # Renders each distinct text once, in parallel processes (TTS and ffmpeg
+    # encoding are CPU/IO heavy and hold the GIL). Returns {text: path or None}.
+    pending = [text for text in dict.fromkeys(texts) if not os.path.exists(media_path(audio_key(text, lang, codec)))]
+    results = {text: media_path(audio_key(text, lang, codec)) for text in texts}
+    if pending:
+        pool = _get_pool(workers)
+        try:
+            for text, (path, seconds) in zip(pending, pool.map(_render_in_worker, [(text, lang, codec) for text in pending])):
+                TTS_SECONDS.observe(seconds)
+                results[text] = path
+        except BrokenProcessPool as e:
+            # A worker died (e.g. OOM-killed); start a fresh pool next time. The
+            # texts left as None are rendered on the send path instead.
+            print(f"Voice note pool failed: {e}")
+            _drop_pool(pool)
+            for text in pending:
+                if not os.path.exists(results[text]):
+                    results[text] = None
+    return results
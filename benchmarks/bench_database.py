@@ -0,0 +1,99 @@
+# Concurrent read/write throughput of database.py before and after the
+# per-thread connection manager (WAL, synchronous=NORMAL, busy_timeout,
+# cached statements).
+#
+#   python benchmarks/bench_database.py [--users 2000] [--readers 8] [--writers 2] [--seconds 5]
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database
+
+def legacy_get(db_path, phone_number):
+    # What every call used to do: fresh connection, default rollback journal
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute("SELECT * FROM users WHERE phone_number = ?", (phone_number,))
+    user = c.fetchone()
+    conn.close()
+    return user
+
+def legacy_update(db_path, phone_number, delivery_time):
+    conn = sqlite3.connect(db_path)
+    c = conn.cursor()
+    c.execute("UPDATE users SET delivery_time = ? WHERE phone_number = ?", (delivery_time, phone_number))
+    conn.commit()
+    conn.close()
+
+def seed(db_path, users):
+    database.DATABASE_NAME = db_path
+    database.close_connection()
+    database.init_db()
+    conn = database.get_connection()
+    with conn:
+        conn.executemany("INSERT INTO users (phone_number, preferred_method, delivery_time, verse_of_day_preference) VALUES (?, 'sms', '08:00', 'john 3:16')",
+                         [(f"+1{i:010d}",) for i in range(users)])
+        conn.execute("INSERT INTO user_translations (user_id, position, translation) SELECT id, 0, 'kjv' FROM users")
+    database.close_connection()
+
+def run(read, write, users, readers, writers, seconds):
+    counts = {"reads": 0, "writes": 0, "errors": 0}
+    lock = threading.Lock()
+    stop = time.time() + seconds
+
+    def worker(kind):
+        done = errors = 0
+        while time.time() < stop:
+            phone = f"+1{random.randrange(users):010d}"
+            try:
+                if kind == "reads":
+                    read(phone)
+                else:
+                    write(phone, f"{random.randrange(24):02d}:00")
+                done += 1
+            except sqlite3.OperationalError:
+                errors += 1 # "database is locked"
+        with lock:
+            counts[kind] += done
+            counts["errors"] += errors
+
+    threads = [threading.Thread(target=worker, args=("reads",)) for _ in range(readers)]
+    threads += [threading.Thread(target=worker, args=("writes",)) for _ in range(writers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {
+        "reads_per_second": round(counts["reads"] / seconds, 1),
+        "writes_per_second": round(counts["writes"] / seconds, 1),
+        "errors": counts["errors"],
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--readers", type=int, default=8)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        before_db = os.path.join(tmp, "before.db")
+        seed(before_db, args.users)
+        sqlite3.connect(before_db).execute("PRAGMA journal_mode=DELETE").close() # The old default
+        before = run(lambda p: legacy_get(before_db, p), lambda p, t: legacy_update(before_db, p, t),
+                     args.users, args.readers, args.writers, args.seconds)
+
+        after_db = os.path.join(tmp, "after.db")
+        seed(after_db, args.users)
+        after = run(database.get_user_preferences, lambda p, t: database.update_user_preferences(p, delivery_time=t),
+                    args.users, args.readers, args.writers, args.seconds)
+
+    print(json.dumps({"benchmark": "database", "params": vars(args), "before": before, "after": after}, indent=2))
@@ -0,0 +1,219 @@
+# Load test of the web app and the scheduler's delivery path against the local
+# bible-api and Twilio stand-ins in stub_servers.py, so nothing leaves the
+# machine. Web: --concurrency threads drive main.app's routes through Flask's
+# test client. Delivery: --users synthetic users are seeded into a fresh
+# database and every bucket runs through delivery.run_bucket while an
+# OutboxDispatcher drains the outbox into the Twilio stub. Prints one JSON
+# report (--output also writes it to a file) to compare across commits.
+#
+#   python benchmarks/bench_load.py [--requests 2000] [--concurrency 16] [--users 1000] [--latency 0.05] [--error-rate 0.01]
+import argparse
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from stub_servers import start_stubs
+from references import books_for
+
+TRANSLATIONS = ["kjv", "web", "bbe", "ylt"]
+REFERENCES = ["John 3:16", "Psalm 23:1", "Romans 8:28", "Philippians 4:13", "Genesis 1:1", "Proverbs 3:5-6"]
+
+def _chapter(rng):
+    translation = rng.choice(TRANSLATIONS)
+    book = rng.choice(books_for(translation))
+    return translation, book["name"], rng.randint(1, book["chapters"])
+
+def _reader_page(rng, pages):
+    return "/%s/%s/%d" % pages[rng.randrange(len(pages))]
+
+def _compare_page(rng, pages):
+    _, book, chapter = pages[rng.randrange(len(pages))]
+    return f"/compare/{book}/{chapter}?t=kjv,web"
+
+# (route, weight, path for a request); reader pages dominate real traffic
+ROUTES = [
+    ("view_chapter", 70, _reader_page),
+    ("compare_chapter", 10, _compare_page),
+    ("twiml_verse", 10, lambda rng, pages: f"/twiml/verse?ref={rng.choice(REFERENCES)}&t={rng.choice(['kjv', 'web', 'bbe'])}"),
+    ("get_books", 5, lambda rng, pages: f"/get_books/{rng.choice(TRANSLATIONS)}"),
+    ("bible_reader", 5, lambda rng, pages: "/"),
+]
+
+def percentiles(values):
+    # Nearest-rank percentiles in milliseconds
+    values = sorted(values)
+    if not values:
+        return {"count": 0}
+    pick = lambda p: round(values[max(0, math.ceil(p / 100 * len(values)) - 1)] * 1000, 2)
+    return {"count": len(values), "mean_ms": round(sum(values) / len(values) * 1000, 2),
+            "p50_ms": pick(50), "p95_ms": pick(95), "p99_ms": pick(99), "max_ms": round(values[-1] * 1000, 2)}
+
+def run_web(app, requests, concurrency, pages, seed):
+    timings = defaultdict(list) # route -> seconds
+    statuses = defaultdict(int)
+    lock = threading.Lock()
+    routes, weights = [r[0] for r in ROUTES], [r[1] for r in ROUTES]
+    paths = {name: make_path for name, _, make_path in ROUTES}
+
+    def worker(index, count):
+        rng = random.Random(f"{seed}|web|{index}")
+        client = app.test_client()
+        mine, codes = defaultdict(list), defaultdict(int)
+        for _ in range(count):
+            route = rng.choices(routes, weights)[0]
+            started = time.perf_counter()
+            response = client.get(paths[route](rng, pages))
+            response.get_data()
+            mine[route].append(time.perf_counter() - started)
+            codes[response.status_code] += 1
+        with lock:
+            for route, values in mine.items():
+                timings[route].extend(values)
+            for code, n in codes.items():
+                statuses[code] += n
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker, args=(i, requests // concurrency + (i < requests % concurrency)))
+               for i in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    everything = [v for values in timings.values() for v in values]
+    return {
+        "requests": len(everything),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(everything) / elapsed, 1),
+        "latency": percentiles(everything),
+        "routes": {route: percentiles(values) for route, values in sorted(timings.items())},
+        "statuses": {str(code): n for code, n in sorted(statuses.items())},
+    }
+
+def seed_users(database, users, buckets, methods, seed):
+    rng = random.Random(f"{seed}|users")
+    rows, translations = [], []
+    for i in range(users):
+        rows.append((f"+1{i:010d}", methods[i % len(methods)], f"08:{i % buckets:02d}",
+                     "random" if rng.random() < 0.5 else rng.choice(REFERENCES)))
+        translations.append(rng.sample(TRANSLATIONS, rng.randint(1, 2)))
+    conn = database.get_connection()
+    with conn:
+        conn.executemany("INSERT INTO users (phone_number, preferred_method, delivery_time, verse_of_day_preference) VALUES (?, ?, ?, ?)", rows)
+        ids = [row[0] for row in conn.execute("SELECT id FROM users ORDER BY id")]
+        conn.executemany("INSERT INTO user_translations (user_id, position, translation) VALUES (?, ?, ?)",
+                         [(user_id, position, t) for user_id, chosen in zip(ids, translations) for position, t in enumerate(chosen)])
+    return sorted({row[2] for row in rows})
+
+def run_delivery(users, buckets, methods, outbox_workers, drain_timeout, seed):
+    import database, delivery
+    from outbox import OutboxDispatcher
+
+    delivery_times = seed_users(database, users, buckets, methods, seed)
+    dispatcher = OutboxDispatcher(workers=outbox_workers, poll_seconds=0.05)
+    started = time.perf_counter()
+    dispatcher.start() # Drains while the buckets are still enqueueing, as in run_scheduler
+    reports = [delivery.run_bucket(delivery_time) for delivery_time in delivery_times]
+    enqueued = time.perf_counter() - started
+    deadline = time.time() + drain_timeout
+    while time.time() < deadline:
+        counts = database.get_outbox_counts()
+        if not counts.get("pending") and not counts.get("sending"):
+            break
+        time.sleep(0.05)
+    elapsed = time.perf_counter() - started
+    dispatcher.stop()
+
+    counts = database.get_outbox_counts()
+    # Enqueue-to-sent time per message, from the outbox rows themselves
+    latencies = [row[0] for row in database.get_connection().execute(
+        "SELECT updated_at - created_at FROM outbox WHERE status = 'sent'")]
+    sent = counts.get("sent", 0)
+    return {
+        "users": users,
+        "buckets": len(delivery_times),
+        "enqueued": sum(report["sent"] for report in reports),
+        "enqueue_failures": sum(report["failed"] for report in reports),
+        "sent": sent,
+        "dead": counts.get("dead", 0),
+        "unfinished": counts.get("pending", 0) + counts.get("sending", 0),
+        "enqueue_seconds": round(enqueued, 3),
+        "seconds": round(elapsed, 3),
+        "deliveries_per_minute": round(sent / elapsed * 60, 1),
+        "bucket_users_per_second": round(sum(r["users"] for r in reports) / max(sum(r["total_seconds"] for r in reports), 1e-9), 1),
+        "enqueue_to_sent": percentiles(latencies),
+        "dispatcher": dict(dispatcher.stats),
+    }
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--requests", type=int, default=2000, help="Web requests in total; 0 skips the web phase")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--pages", type=int, default=200, help="Distinct chapters the reader traffic is spread over")
+    parser.add_argument("--users", type=int, default=1000, help="Synthetic subscribers; 0 skips the delivery phase")
+    parser.add_argument("--buckets", type=int, default=5, help="Distinct delivery times the users are spread over")
+    parser.add_argument("--methods", default="sms,whatsapp_text,call",
+                        help="Delivery methods to cycle through (whatsapp_voice_note needs gTTS, i.e. the network)")
+    parser.add_argument("--outbox-workers", type=int, default=4)
+    parser.add_argument("--send-rate", type=float, default=1000, help="Per-sender Twilio rate limit, messages/second")
+    parser.add_argument("--drain-timeout", type=float, default=120)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds the bible-api stub takes per response")
+    parser.add_argument("--twilio-latency", type=float, default=0.1)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of bible-api responses that are 503s")
+    parser.add_argument("--twilio-error-rate", type=float, default=0.0)
+    parser.add_argument("--twilio-error-status", type=int, default=503, help="4xx are permanent failures, 5xx/429 are retried")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Also write the JSON report here")
+    args = parser.parse_args()
+
+    api, twilio = start_stubs(latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                              twilio_latency=args.twilio_latency, twilio_error_rate=args.twilio_error_rate,
+                              twilio_error_status=args.twilio_error_status, seed=args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        # Config is read at import time, so everything is pointed at the stubs and a scratch directory first
+        os.environ.update(BIBLE_API_URL=api.url, TWILIO_API_URL=twilio.url, TWILIO_ACCOUNT_SID="AC" + "0" * 32,
+                          TWILIO_AUTH_TOKEN="stub", TWILIO_PHONE_NUMBER="+15550000000", TWILIO_WHATSAPP_NUMBER="+15550000001",
+                          DATABASE_NAME=os.path.join(tmp, "users.db"), CACHE_DB_NAME=os.path.join(tmp, "cache.db"),
+                          CORPUS_DB_NAME=os.path.join(tmp, "corpus.db"), MEDIA_DIR=os.path.join(tmp, "media"),
+                          SMS_SEND_RATE=str(args.send_rate), WHATSAPP_SEND_RATE=str(args.send_rate),
+                          VOICE_CALL_RATE=str(args.send_rate))
+        os.environ.setdefault("OUTBOX_RETRY_BASE_SECONDS", "0.05") # Retries within the run, not 30s later
+        os.environ.setdefault("UPSTREAM_BACKOFF_SECONDS", "0.05")
+        import main
+        from cache import cache_stats
+        from upstream import upstream_stats
+
+        rng = random.Random(f"{args.seed}|pages")
+        pages = [_chapter(rng) for _ in range(args.pages)]
+        report = {"benchmark": "load", "commit": git_commit(), "params": vars(args)}
+        if args.requests:
+            report["web"] = run_web(main.app, args.requests, args.concurrency, pages, args.seed)
+        if args.users:
+            report["delivery"] = run_delivery(args.users, args.buckets, args.methods.split(","), args.outbox_workers,
+                                              args.drain_timeout, args.seed)
+        report.update(upstream=upstream_stats(), cache=cache_stats(), stubs={"bible_api": api.stats, "twilio": twilio.stats})
+    api.stop()
+    twilio.stop()
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
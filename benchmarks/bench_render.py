@@ -0,0 +1,65 @@
+# Chapter page renders per second with and without the fragment cache
+# (fragments.py). Upstream, prefetch and the HTTP body cache are bypassed so
+# only template work is measured.
+#
+#   python benchmarks/bench_render.py [--pages 200] [--seconds 5]
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+_tmp = tempfile.TemporaryDirectory()
+os.environ.setdefault("DATABASE_NAME", os.path.join(_tmp.name, "users.db"))
+os.environ.setdefault("CACHE_DB_NAME", os.path.join(_tmp.name, "cache.db"))
+os.environ.setdefault("CORPUS_DB_NAME", os.path.join(_tmp.name, "corpus.db"))
+import fragments
+import main
+
+def fake_chapter(translation, book_name, chapter_number):
+    verses = [{"book_name": book_name, "chapter": chapter_number, "verse": v,
+               "text": f"Verse {v} of {book_name} {chapter_number}, long enough to look like real scripture text."}
+              for v in range(1, 31)]
+    return {"book_name": book_name, "chapter": chapter_number, "translation": translation.upper(),
+            "verses": verses, "text": ""}
+
+def sample_pages(count):
+    # A working set of pages spread over every translation and book, like a busy day of readers
+    pages = []
+    for _ in range(count):
+        translation = random.choice(main.get_all_translations())["id"]
+        book = random.choice(main.get_books_for_translation(translation))
+        pages.append((translation, book["name"], random.randint(1, int(book["chapters"]))))
+    return pages
+
+def run(pages, seconds):
+    view = main.view_chapter.__wrapped__ # Skip the ETag/stored-body layer
+    rendered = 0
+    stop = time.time() + seconds
+    while time.time() < stop:
+        translation, book, chapter = pages[rendered % len(pages)]
+        with main.app.test_request_context(f"/{translation}/{book}/{chapter}"):
+            view(translation, book, chapter)
+        rendered += 1
+    return {"renders_per_second": round(rendered / seconds, 1)}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pages", type=int, default=200)
+    parser.add_argument("--seconds", type=float, default=5)
+    args = parser.parse_args()
+
+    main.get_chapter_content = fake_chapter
+    main.note_request = lambda *a: None
+    main.schedule_adjacent = lambda *a: None
+    pages = sample_pages(args.pages)
+
+    fragments.enabled = False
+    before = run(pages, args.seconds)
+    fragments.enabled = True
+    after = run(pages, args.seconds)
+    print(json.dumps({"benchmark": "render", "params": vars(args), "before": before, "after": after,
+                      "fragments": fragments.fragment_stats()}, indent=2))
@@ -0,0 +1,79 @@
+# Import time and memory of a fresh web worker (`import main`, what gunicorn
+# does per worker) next to the scheduler (`import delivery`). Fails if the web
+# worker goes over budget or loads any delivery-only dependency.
+#
+#   python benchmarks/bench_startup.py [--runs 5] [--max-import-ms 600] [--max-rss-mb 80]
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# Only the scheduler/outbox need these; a web worker importing them is a regression
+DELIVERY_ONLY = ["twilio", "gtts", "pydub", "multiprocessing", "delivery", "outbox", "audio"]
+
+PROBE = """
+import json, resource, sys, time
+started = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - started
+loaded = sorted({{name.split(".")[0] for name in sys.modules}} & set({heavy!r}))
+print(json.dumps({{"import_ms": elapsed * 1000, "rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, "loaded": loaded}}))
+"""
+
+def parse_importtime(stderr, top=10):
+    # "import time: self [us] | cumulative | imported package", nested two
+    # spaces per level -> the heaviest direct imports (depth 1) by cumulative time
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:
+            rows.append((int(cumulative_us), name.strip()))
+    rows.sort(reverse=True)
+    return [{"module": name, "cumulative_ms": round(us / 1000, 1)} for us, name in rows[:top]]
+
+def probe(module, env):
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", PROBE.format(module=module, heavy=DELIVERY_ONLY)],
+                            cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    report = json.loads(result.stdout.strip().splitlines()[-1])
+    report["heaviest"] = parse_importtime(result.stderr)
+    return report
+
+def measure(module, runs, env):
+    reports = [probe(module, env) for _ in range(runs)]
+    return {
+        "import_ms": round(statistics.median(r["import_ms"] for r in reports), 1),
+        "rss_mb": round(statistics.median(r["rss_kb"] for r in reports) / 1024, 1),
+        "delivery_only_loaded": reports[-1]["loaded"],
+        "heaviest": reports[-1]["heaviest"],
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import-ms", type=float, default=600)
+    parser.add_argument("--max-rss-mb", type=float, default=80)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, DATABASE_NAME=os.path.join(tmp, "users.db"), CACHE_DB_NAME=os.path.join(tmp, "cache.db"),
+                   CORPUS_DB_NAME=os.path.join(tmp, "corpus.db"), MEDIA_DIR=os.path.join(tmp, "media"))
+        web = measure("main", args.runs, env)
+        scheduler = measure("delivery", args.runs, env)
+
+    problems = []
+    if web["import_ms"] > args.max_import_ms:
+        problems.append(f"web import took {web['import_ms']}ms (budget {args.max_import_ms}ms)")
+    if web["rss_mb"] > args.max_rss_mb:
+        problems.append(f"web RSS is {web['rss_mb']}MB (budget {args.max_rss_mb}MB)")
+    if web["delivery_only_loaded"]:
+        problems.append(f"web worker imported delivery-only modules: {', '.join(web['delivery_only_loaded'])}")
+    print(json.dumps({"benchmark": "startup", "params": vars(args), "web": web, "scheduler": scheduler,
+                      "ok": not problems, "problems": problems}, indent=2))
+    sys.exit(1 if problems else 0)
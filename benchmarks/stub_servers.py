@@ -0,0 +1,165 @@
+# Local stand-ins for bible-api.com and the Twilio REST API, with configurable
+# latency and error rates, for load tests that shouldn't touch the real
+# services. bench_load.py starts them in-process; run this file to start them
+# on their own and point a real web app or scheduler at them:
+#
+#   python benchmarks/stub_servers.py [--api-port 8001] [--twilio-port 8002] [--latency 0.05] [--error-rate 0.01]
+#   BIBLE_API_URL=http://127.0.0.1:8001 gunicorn main:app
+#   BIBLE_API_URL=http://127.0.0.1:8001 TWILIO_API_URL=http://127.0.0.1:8002 python delivery.py
+import argparse
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlsplit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from references import InvalidReference, parse_reference, verse_count
+
+TRANSLATION_NAMES = {"kjv": "King James Version", "web": "World English Bible", "bbe": "Bible in Basic English",
+                     "ylt": "Young's Literal Translation"}
+WORDS = "and the lord said unto them behold i am with you always even unto the end of the world".split()
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128 # The default of 5 resets connections under load
+
+class StubServer:
+    # Serves `route(method, path, query, body) -> (status, payload)`
+    # as JSON after `latency` (+ up to `jitter`) seconds; `error_rate` of the
+    # requests get `error_status` instead.
+    def __init__(self, name, route, port=0, latency=0.0, jitter=0.0, error_rate=0.0, error_status=503, seed=None):
+        self.name = name
+        self.route = route
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.stats = {"requests": 0, "errors_injected": 0, "not_found": 0}
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = _Server(("127.0.0.1", port), self._handler_class())
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def _handler_class(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1" # Keep-alive, like the real services
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = parse_qs(self.rfile.read(length).decode("utf-8")) if length else {}
+                parts = urlsplit(self.path)
+                with stub._lock:
+                    stub.stats["requests"] += 1
+                    delay = stub.latency + stub._rng.uniform(0, stub.jitter)
+                    fail = stub._rng.random() < stub.error_rate
+                if delay:
+                    time.sleep(delay)
+                if fail:
+                    with stub._lock:
+                        stub.stats["errors_injected"] += 1
+                    status, payload = stub.error_status, {"code": 20500, "status": stub.error_status,
+                                                          "message": "Simulated failure", "error": "Simulated failure"}
+                else:
+                    status, payload = stub.route(self.command, unquote(parts.path), parse_qs(parts.query), body)
+                    if status == 404:
+                        with stub._lock:
+                            stub.stats["not_found"] += 1
+                data = json.dumps(payload).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = _handle
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self._server.serve_forever, name=f"stub-{self.name}", daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+def _verse_text(rng, words=12):
+    return " ".join(rng.choice(WORDS) for _ in range(words)).capitalize() + ".\n"
+
+def bible_api_route(method, path, query, body):
+    # GET /<reference>?translation=kjv -> bible-api.com's passage JSON, with
+    # deterministic filler text so responses are the same size on every run
+    translation = query.get("translation", ["web"])[0].lower()
+    try:
+        ref = parse_reference(path.lstrip("/"), translation)
+    except InvalidReference:
+        return 404, {"error": "not found"}
+    first = ref.verse or 1
+    last = ref.end_verse or ref.verse or verse_count(ref.book, ref.chapter) or 30
+    rng = random.Random(f"{translation}|{ref.book}|{ref.chapter}")
+    verses = [{"book_id": ref.usfm, "book_name": ref.name, "chapter": ref.chapter, "verse": verse,
+               "text": _verse_text(rng)} for verse in range(1, last + 1)][first - 1:]
+    return 200, {
+        "reference": str(ref),
+        "verses": verses,
+        "text": "".join(v["text"] for v in verses),
+        "translation_id": translation,
+        "translation_name": TRANSLATION_NAMES.get(translation, translation.upper()),
+        "translation_note": "Public Domain",
+    }
+
+_sids = itertools.count(1)
+
+def twilio_route(method, path, query, body):
+    # POST /2010-04-01/Accounts/<sid>/Messages.json or Calls.json
+    parts = path.strip("/").split("/")
+    if method != "POST" or len(parts) != 4 or parts[3] not in ("Messages.json", "Calls.json"):
+        return 404, {"code": 20404, "status": 404, "message": "The requested resource was not found"}
+    prefix = "SM" if parts[3] == "Messages.json" else "CA"
+    return 201, {
+        "sid": f"{prefix}{next(_sids):032d}",
+        "account_sid": parts[2],
+        "to": body.get("To", [""])[0],
+        "from": body.get("From", [""])[0],
+        "status": "queued",
+    }
+
+def start_stubs(api_port=0, twilio_port=0, latency=0.0, jitter=0.0, error_rate=0.0, api_error_status=503,
+                twilio_latency=None, twilio_error_rate=None, twilio_error_status=503, seed=None):
+    # Twilio settings default to the bible-api ones
+    api = StubServer("bible-api", bible_api_route, api_port, latency, jitter, error_rate, api_error_status, seed).start()
+    twilio = StubServer("twilio", twilio_route, twilio_port, latency if twilio_latency is None else twilio_latency, jitter,
+                        error_rate if twilio_error_rate is None else twilio_error_rate, twilio_error_status,
+                        None if seed is None else seed + 1).start()
+    return api, twilio
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--api-port", type=int, default=8001)
+    parser.add_argument("--twilio-port", type=int, default=8002)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds added to every response")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Up to this many extra seconds, uniformly")
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=503)
+    args = parser.parse_args()
+
+    api, twilio = start_stubs(args.api_port, args.twilio_port, args.latency, args.jitter, args.error_rate,
+                              args.error_status, twilio_error_status=args.error_status)
+    print(f"bible-api stub on {api.url}, Twilio stub on {twilio.url}. Ctrl-C to stop.")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"bible-api: {api.stats} | twilio: {twilio.stats}")
+    except KeyboardInterrupt:
+        api.stop()
+        twilio.stop()
@@ -0,0 +1,191 @@
+import re
+import time
+import uuid
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from html import escape
+from zlib import crc32
+from flask import render_template
+from markupsafe import Markup
+from config import EXPORT_WORKERS, EXPORT_READ_AHEAD, EXPORT_MAX_CHAPTERS
+from references import InvalidReference, book_index, book_name
+from utils import AVAILABLE_BOOKS, AVAILABLE_TRANSLATIONS, get_chapter_content
+
+# Whole-book and reading-plan downloads, streamed chapter by chapter while the
+# next few chapters are fetched in the background. Only the read-ahead window
+# is ever held in memory, however long the export.
+FORMATS = {"txt": "text/plain; charset=utf-8", "html": "text/html; charset=utf-8", "epub": "application/epub+zip"}
+LANGUAGES = {"cherokee": "chr", "cuv": "zh", "bkr": "cs", "clementine": "la", "almeida": "pt", "rccv": "ro"} # Others are English
+_PLAN_ITEM = re.compile(r"^(?P<book>.+?)(?:\s+(?P<first>\d+)(?:\s*[-–]\s*(?P<last>\d+))?)?$")
+_executor = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+
+def display_name(translation):
+    return next((t["name"] for t in AVAILABLE_TRANSLATIONS if t["id"] == translation.lower()), translation.upper())
+
+def plan_chapters(translation, plan):
+    # "Genesis 1-3; Psalm 23; Jude" -> [(book name, chapter), ...]. A book on
+    # its own means all of it, per the translation's AVAILABLE_BOOKS chapter counts.
+    counts = {book["name"]: book["chapters"] for book in AVAILABLE_BOOKS.get(translation.upper(), [])}
+    if not counts:
+        raise InvalidReference(f"Unknown translation: {translation}")
+    chapters = []
+    for item in re.split(r"[;\n]", plan):
+        match = _PLAN_ITEM.match(item.strip())
+        if not match:
+            continue
+        book = book_index(match.group("book"), translation)
+        if book is None:
+            raise InvalidReference(f"Unknown book: {match.group('book')!r}")
+        name = book_name(book)
+        if name not in counts:
+            raise InvalidReference(f"{name} is not in the {translation.upper()} translation")
+        first = int(match.group("first") or 1)
+        last = int(match.group("last") or match.group("first") or counts[name])
+        if not 1 <= first <= last <= counts[name]:
+            raise InvalidReference(f"{item.strip()} is outside {name} 1-{counts[name]}")
+        chapters.extend((name, chapter) for chapter in range(first, last + 1))
+    chapters = list(dict.fromkeys(chapters)) # A chapter listed twice is exported once
+    if not chapters:
+        raise InvalidReference("The reading plan is empty")
+    if len(chapters) > EXPORT_MAX_CHAPTERS:
+        raise InvalidReference(f"Exports are limited to {EXPORT_MAX_CHAPTERS} chapters; this plan has {len(chapters)}")
+    return chapters
+
+def iter_chapters(translation, chapters, read_ahead=EXPORT_READ_AHEAD):
+    # Yields (book, chapter, get_chapter_content(...)) in plan order, with up to
+    # `read_ahead` later chapters already being fetched
+    upcoming = iter(chapters)
+    pending = deque()
+
+    def submit():
+        for book, chapter in upcoming:
+            pending.append((book, chapter, _executor.submit(get_chapter_content, translation, book, chapter)))
+            return
+
+    try:
+        for _ in range(read_ahead):
+            submit()
+        while pending:
+            book, chapter, future = pending.popleft()
+            submit()
+            yield book, chapter, future.result()
+    finally:
+        for _, _, future in pending: # The client went away; don't fetch what nobody will read
+            future.cancel()
+
+def _anchor(book, chapter):
+    return f"{re.sub(r'[^A-Za-z0-9]+', '-', book).strip('-').lower()}-{chapter}"
+
+def render_txt(title, translation, chapters):
+    yield f"{title}\n{display_name(translation)}\n"
+    for book, chapter, data in chapters:
+        lines = [f"{verse['verse']} {verse['text'].strip()}" for verse in data["verses"]] or [f"[{data['text']}]"]
+        yield f"\n{book} {chapter}\n\n" + "\n".join(lines) + "\n"
+
+def render_html(chapters):
+    # One chunk per chapter; stream_template (in the view) runs this inside the request context
+    for book, chapter, data in chapters:
+        yield Markup(render_template("export/chapter.html", book=book, chapter=chapter, data=data, anchor=_anchor(book, chapter)))
+
+class _ZipStream:
+    # Write-only file for ZipFile that hands back whatever was written since the
+    # last drain(); without seek() ZipFile writes data descriptors instead of
+    # going back to patch headers, so entries can be sent as soon as they're written.
+    def __init__(self):
+        self.parts = []
+        self.position = 0
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.parts)
+        self.parts = []
+        return data
+
+def _epub_package(title, translation, plan, language):
+    # content.opf and nav.xhtml list every chapter, and the plan is known up front
+    identifier = uuid.uuid5(uuid.NAMESPACE_URL, f"bible-export:{translation}:{plan}")
+    modified = time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+    items = "\n".join(f'    <item id="c{i}" href="{_anchor(book, chapter)}.xhtml" media-type="application/xhtml+xml"/>'
+                      for i, (book, chapter) in enumerate(plan))
+    spine = "\n".join(f'    <itemref idref="c{i}"/>' for i in range(len(plan)))
+    opf = f"""<?xml version="1.0" encoding="UTF-8"?>
+<package xmlns="http://www.idpf.org/2007/opf" version="3.0" unique-identifier="id" xml:lang="{language}">
+  <metadata xmlns:dc="http://purl.org/dc/elements/1.1/">
+    <dc:identifier id="id">urn:uuid:{identifier}</dc:identifier>
+    <dc:title>{escape(title)}</dc:title>
+    <dc:contributor>{escape(display_name(translation))}</dc:contributor>
+    <dc:language>{language}</dc:language>
+    <meta property="dcterms:modified">{modified}</meta>
+  </metadata>
+  <manifest>
+    <item id="nav" href="nav.xhtml" media-type="application/xhtml+xml" properties="nav"/>
+{items}
+  </manifest>
+  <spine>
+{spine}
+  </spine>
+</package>
+"""
+    links = "\n".join(f'      <li><a href="{_anchor(book, chapter)}.xhtml">{escape(book)} {chapter}</a></li>' for book, chapter in plan)
+    nav = f"""<?xml version="1.0" encoding="UTF-8"?>
+<!DOCTYPE html>
+<html xmlns="http://www.w3.org/1999/xhtml" xmlns:epub="http://www.idpf.org/2007/ops" xml:lang="{language}" lang="{language}">
+<head><title>{escape(title)}</title></head>
+<body>
+  <nav epub:type="toc" id="toc">
+    <h1>{escape(title)}</h1>
+    <ol>
+{links}
+    </ol>
+  </nav>
+</body>
+</html>
+"""
+    return opf, nav
+
+CONTAINER_XML = """<?xml version="1.0" encoding="UTF-8"?>
+<container version="1.0" xmlns="urn:oasis:names:tc:opendocument:xmlns:container">
+  <rootfiles>
+    <rootfile full-path="OEBPS/content.opf" media-type="application/oebps-package+xml"/>
+  </rootfiles>
+</container>
+"""
+
+def render_epub(title, translation, plan, chapters):
+    # `plan` is the (book, chapter) list and `chapters` the fetched content, in the same order
+    language = LANGUAGES.get(translation.lower(), "en")
+    stream = _ZipStream()
+    # The mimetype entry must come first, uncompressed, with its sizes in the
+    # local header (no data descriptor), so it is written by hand and
+    # registered with the archive for the central directory
+    mimetype = zipfile.ZipInfo("mimetype", time.localtime()[:6])
+    content = b"application/epub+zip"
+    mimetype.CRC, mimetype.file_size, mimetype.compress_size, mimetype.header_offset = crc32(content), len(content), len(content), 0
+    stream.write(mimetype.FileHeader() + content)
+    archive = zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED)
+    archive.filelist.append(mimetype)
+    archive.NameToInfo[mimetype.filename] = mimetype
+
+    opf, nav = _epub_package(title, translation, plan, language)
+    archive.writestr("META-INF/container.xml", CONTAINER_XML)
+    archive.writestr("OEBPS/content.opf", opf)
+    archive.writestr("OEBPS/nav.xhtml", nav)
+    yield stream.drain()
+    for book, chapter, data in chapters:
+        archive.writestr(f"OEBPS/{_anchor(book, chapter)}.xhtml",
+                         render_template("export/chapter.xhtml", book=book, chapter=chapter, data=data,
+                                         anchor=_anchor(book, chapter), language=language))
+        yield stream.drain()
+    archive.close()
+    yield stream.drain()
@@ -0,0 +1,176 @@
+import argparse
+import csv
+import io
+import json
+import re
+import sys
+import time
+from database import init_db, iter_users, upsert_users
+from references import InvalidReference, normalize_verse_preference
+from utils import AVAILABLE_TRANSLATIONS
+
+# Bulk onboarding: stream CSV or JSONL subscribers into the users table in
+# batched upserts, and stream the table back out. Neither side holds more than
+# one batch in memory.
+IMPORT_BATCH = 2000
+EXPORT_BATCH = 500
+MAX_REPORTED_ERRORS = 100 # Every invalid row is counted; only the first ones are described
+FORMATS = ("csv", "jsonl")
+METHODS = ("whatsapp_text", "whatsapp_voice_note", "call", "sms")
+FIELDS = ["phone_number", "preferred_method", "delivery_time", "bible_id", "verse_of_day_preference"]
+ALIASES = {"translations": "bible_id", "bible_translation": "bible_id", "verse_preference": "verse_of_day_preference"}
+TRANSLATION_IDS = {t["id"] for t in AVAILABLE_TRANSLATIONS}
+
+_PHONE_PUNCTUATION = re.compile(r"[\s().-]")
+_E164 = re.compile(r"^\+[1-9]\d{6,14}$")
+_TIME = re.compile(r"^([01]?\d|2[0-3]):([0-5]\d)(:00)?$")
+
+class InvalidRow(ValueError):
+    pass
+
+def read_csv(stream):
+    # Yields (line number, record); `stream` is a text file object
+    reader = csv.DictReader(stream)
+    for record in reader:
+        yield reader.line_num, record
+
+def read_jsonl(stream):
+    for line_number, line in enumerate(stream, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError as e:
+            yield line_number, InvalidRow(f"Not valid JSON: {e}")
+            continue
+        yield line_number, record if isinstance(record, dict) else InvalidRow("Expected a JSON object")
+
+READERS = {"csv": read_csv, "jsonl": read_jsonl}
+
+def _text(record, field, default=""):
+    # CSV fields are always strings; JSONL ones can be anything
+    value = record.get(field)
+    if value is None or value == "":
+        return default
+    if not isinstance(value, str):
+        raise InvalidRow(f"{field} must be a string, got {value!r}")
+    return value
+
+def validate(record):
+    # One import record -> a row for database.upsert_users, or InvalidRow
+    if isinstance(record, InvalidRow):
+        raise record
+    record = {ALIASES.get(key.strip(), key.strip()): value for key, value in record.items() if key}
+    phone_number = _PHONE_PUNCTUATION.sub("", _text(record, "phone_number"))
+    if not _E164.match(phone_number):
+        raise InvalidRow(f"phone_number must be in E.164 form (e.g. +15551234567), got {record.get('phone_number')!r}")
+    method = _text(record, "preferred_method").strip().lower()
+    if method not in METHODS:
+        raise InvalidRow(f"preferred_method must be one of {', '.join(METHODS)}, got {record.get('preferred_method')!r}")
+    match = _TIME.match(_text(record, "delivery_time").strip())
+    if not match:
+        raise InvalidRow(f"delivery_time must be HH:MM (24-hour), got {record.get('delivery_time')!r}")
+    translations = record.get("bible_id")
+    if translations is None:
+        translations = []
+    if isinstance(translations, str):
+        translations = re.split(r"[,\s]+", translations)
+    if not isinstance(translations, list) or not all(isinstance(t, str) for t in translations):
+        raise InvalidRow(f"bible_id must be a string or a list of strings, got {record.get('bible_id')!r}")
+    translations = list(dict.fromkeys(t.strip().lower() for t in translations if t.strip()))
+    unknown = [t for t in translations if t not in TRANSLATION_IDS]
+    if unknown:
+        raise InvalidRow(f"Unknown translation(s): {', '.join(unknown)}")
+    try:
+        verse = normalize_verse_preference(_text(record, "verse_of_day_preference", "random"), translations)
+    except InvalidReference as e:
+        raise InvalidRow(f"Invalid verse_of_day_preference: {e}")
+    return phone_number, method, f"{int(match.group(1)):02d}:{match.group(2)}", translations, verse
+
+def import_users(records, batch_size=IMPORT_BATCH, dry_run=False, on_error=None):
+    # `records` yields (line number, record). Valid rows are upserted one batch
+    # per transaction, so a bad row is reported and skipped rather than failing
+    # the whole file, and a crash keeps the batches already committed.
+    summary = {"rows": 0, "created": 0, "updated": 0, "invalid": 0, "errors": []}
+    batch = []
+
+    def flush():
+        if batch and not dry_run:
+            created, updated = upsert_users(batch)
+            summary["created"] += created
+            summary["updated"] += updated
+        batch.clear()
+
+    started = time.time()
+    for line_number, record in records:
+        summary["rows"] += 1
+        try:
+            batch.append(validate(record))
+        except InvalidRow as e:
+            summary["invalid"] += 1
+            error = {"line": line_number, "error": str(e)}
+            if len(summary["errors"]) < MAX_REPORTED_ERRORS:
+                summary["errors"].append(error)
+            if on_error:
+                on_error(error)
+            continue
+        if len(batch) >= batch_size:
+            flush()
+    flush()
+    summary["seconds"] = round(time.time() - started, 3)
+    return summary
+
+def export_users(fmt="csv", batch_size=EXPORT_BATCH):
+    # Yields the users table as CSV or JSONL text, one chunk per batch of users
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    if fmt == "csv":
+        writer.writerow(FIELDS)
+    count = 0
+    for user in iter_users(batch_size=batch_size):
+        if fmt == "csv":
+            writer.writerow([user["phone_number"], user["preferred_method"], user["delivery_time"],
+                             ",".join(user["bible_id"]), user["verse_of_day_preference"]])
+        else:
+            buffer.write(json.dumps({field: user[field] for field in FIELDS}) + "\n")
+        count += 1
+        if count % batch_size == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue()
+
+def detect_format(name):
+    return "jsonl" if name.lower().endswith((".jsonl", ".ndjson", ".json")) else "csv"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import/export of subscribers.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    import_cmd = sub.add_parser("import", help="Upsert users from a CSV (with a header row) or JSONL file")
+    import_cmd.add_argument("path", help="File to read, or - for stdin")
+    import_cmd.add_argument("--format", choices=FORMATS, help="Defaults to guessing from the file extension")
+    import_cmd.add_argument("--batch-size", type=int, default=IMPORT_BATCH)
+    import_cmd.add_argument("--dry-run", action="store_true", help="Validate only")
+    export_cmd = sub.add_parser("export", help="Write every user as CSV or JSONL")
+    export_cmd.add_argument("--format", choices=FORMATS, default="csv")
+    export_cmd.add_argument("-o", "--output", help="Defaults to stdout")
+    args = parser.parse_args()
+
+    init_db()
+    if args.command == "import":
+        fmt = args.format or detect_format(args.path)
+        stream = (io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8-sig", newline="") if args.path == "-"
+                  else open(args.path, encoding="utf-8-sig", newline=""))
+        with stream:
+            summary = import_users(READERS[fmt](stream), args.batch_size, args.dry_run,
+                                   on_error=lambda error: print(f"Line {error['line']}: {error['error']}", file=sys.stderr))
+        print(f"{'Checked' if args.dry_run else 'Imported'} {summary['rows']} row(s) in {summary['seconds']}s: "
+              f"{summary['created']} created, {summary['updated']} updated, {summary['invalid']} invalid")
+        sys.exit(1 if summary["invalid"] else 0)
+    else:
+        out = open(args.output, "w", encoding="utf-8", newline="") if args.output else sys.stdout
+        for chunk in export_users(args.format):
+            out.write(chunk)
+        if args.output:
+            out.close()
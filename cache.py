@@ -0,0 +1,209 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from metrics import SQLITE_SECONDS, timed
+from config import CACHE_DB_NAME, CACHE_MEMORY_ENTRIES, CACHE_DISK_ENTRIES, CACHE_TTL_SECONDS, CACHE_STALE_SECONDS
+
+# Two tiers: a small in-process LRU for hot chapters, backed by a SQLite table
+# that every gunicorn worker (and the scheduler) shares.
+_memory = OrderedDict() # key -> (value, stored_at)
+_memory_lock = threading.Lock()
+_refreshing = set() # keys with a background refresh in flight
+_local = threading.local() # one SQLite connection per thread
+_writes_since_trim = 0
+TRIM_EVERY = 50 # Check the disk tier's size every N writes
+REFRESH_WORKERS = 4
+# Stale-while-revalidate refreshes; _refreshing keeps one per key in flight, so
+# a burst of stale hits queues work here instead of starting a thread per key
+_refresh_executor = ThreadPoolExecutor(max_workers=REFRESH_WORKERS, thread_name_prefix="cache-refresh")
+_stats_lock = threading.Lock() # Guards stats and _writes_since_trim; they're updated from every request thread
+TOUCH_AFTER_SECONDS = 3600 # A disk hit only rewrites last_used once it's this stale; eviction doesn't need finer
+
+stats = {
+    "memory_hits": 0,
+    "disk_hits": 0,
+    "misses": 0,
+    "stale_served": 0,
+    "refreshes": 0,
+    "errors_served_stale": 0,
+    "memory_evictions": 0,
+    "disk_evictions": 0,
+}
+
+def _count(name, n=1):
+    with _stats_lock:
+        stats[name] += n
+
+def make_key(kind, translation, *parts):
+    # e.g. ("chapter", "KJV", "John", 3) -> "chapter|kjv|john|3"
+    return "|".join([kind, translation.lower()] + [str(p).strip().lower() for p in parts])
+
+def _get_conn():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(CACHE_DB_NAME, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL") # Readers in other workers don't block on our writes
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                stored_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_last_used ON cache_entries (last_used)")
+        conn.commit()
+        _local.conn = conn
+    return conn
+
+def _memory_get(key):
+    with _memory_lock:
+        entry = _memory.get(key)
+        if entry is not None:
+            _memory.move_to_end(key)
+        return entry
+
+def _memory_put(key, value, stored_at):
+    with _memory_lock:
+        _memory[key] = (value, stored_at)
+        _memory.move_to_end(key)
+        while len(_memory) > CACHE_MEMORY_ENTRIES:
+            _memory.popitem(last=False)
+            _count("memory_evictions")
+
+@timed(SQLITE_SECONDS, db="cache", op="disk_get")
+def _disk_get(key):
+    try:
+        conn = _get_conn()
+        row = conn.execute("SELECT value, stored_at, last_used FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        now = time.time()
+        if now - row[2] > TOUCH_AFTER_SECONDS:
+            # Most hits are read-only and never wait on the write lock
+            conn.execute("UPDATE cache_entries SET last_used = ? WHERE key = ?", (now, key))
+            conn.commit()
+        return json.loads(row[0]), row[1]
+    except sqlite3.Error as e:
+        print(f"Cache read failed for {key}: {e}")
+        return None
+
+@timed(SQLITE_SECONDS, db="cache", op="disk_put")
+def _disk_put(key, value, stored_at):
+    global _writes_since_trim
+    try:
+        conn = _get_conn()
+        conn.execute("INSERT OR REPLACE INTO cache_entries (key, value, stored_at, last_used) VALUES (?, ?, ?, ?)",
+                     (key, json.dumps(value), stored_at, stored_at))
+        conn.commit()
+        with _stats_lock:
+            _writes_since_trim += 1
+            trim = _writes_since_trim >= TRIM_EVERY
+            if trim:
+                _writes_since_trim = 0
+        if trim:
+            _trim_disk(conn)
+    except sqlite3.Error as e:
+        print(f"Cache write failed for {key}: {e}")
+
+def _trim_disk(conn):
+    # Size-bounded eviction: drop the least recently used rows beyond the limit
+    count = conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+    excess = count - CACHE_DISK_ENTRIES
+    if excess > 0:
+        conn.execute("DELETE FROM cache_entries WHERE key IN (SELECT key FROM cache_entries ORDER BY last_used LIMIT ?)", (excess,))
+        conn.commit()
+        _count("disk_evictions", excess)
+
+def cache_put(key, value):
+    stored_at = time.time()
+    _memory_put(key, value, stored_at)
+    _disk_put(key, value, stored_at)
+
+def cache_get(key):
+    # Returns (value, stored_at) from whichever tier has it, or None
+    entry = _memory_get(key)
+    if entry is not None:
+        _count("memory_hits")
+        return entry
+    entry = _disk_get(key)
+    if entry is not None:
+        _count("disk_hits")
+        _memory_put(key, entry[0], entry[1])
+    return entry
+
+def cache_has_fresh(key):
+    # Peek without touching hit/miss counters or LRU order
+    with _memory_lock:
+        entry = _memory.get(key)
+    if entry is None:
+        try:
+            row = _get_conn().execute("SELECT stored_at FROM cache_entries WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error:
+            return False
+        if row is None:
+            return False
+        stored_at = row[0]
+    else:
+        stored_at = entry[1]
+    return time.time() - stored_at < CACHE_TTL_SECONDS
+
+def _refresh(key, fetch):
+    try:
+        value = fetch()
+        if value is not None:
+            cache_put(key, value)
+            _count("refreshes")
+    except Exception as e:
+        print(f"Background refresh failed for {key}: {e}")
+    finally:
+        with _memory_lock:
+            _refreshing.discard(key)
+
+def _refresh_async(key, fetch):
+    with _memory_lock:
+        if key in _refreshing:
+            return
+        _refreshing.add(key)
+    _refresh_executor.submit(_refresh, key, fetch)
+
+def cached_fetch(key, fetch):
+    # fetch() returns the value to cache, or None for "nothing worth caching".
+    # Fresh entries are served as-is, stale ones are served while a background
+    # refresh runs, and an expired entry is still better than an upstream error.
+    entry = cache_get(key)
+    if entry is not None:
+        value, stored_at = entry
+        age = time.time() - stored_at
+        if age < CACHE_TTL_SECONDS:
+            return value
+        if age < CACHE_TTL_SECONDS + CACHE_STALE_SECONDS:
+            _count("stale_served")
+            _refresh_async(key, fetch)
+            return value
+    else:
+        _count("misses")
+
+    try:
+        value = fetch()
+    except Exception:
+        if entry is not None:
+            _count("errors_served_stale")
+            return entry[0]
+        raise
+    if value is not None:
+        cache_put(key, value)
+    return value
+
+def cache_stats():
+    with _memory_lock:
+        memory_entries = len(_memory)
+    with _stats_lock:
+        counts = dict(stats)
+    lookups = counts["memory_hits"] + counts["disk_hits"] + counts["misses"]
+    hit_ratio = (counts["memory_hits"] + counts["disk_hits"]) / lookups if lookups else 0.0
+    return dict(counts, memory_entries=memory_entries, hit_ratio=round(hit_ratio, 4))
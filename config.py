@@ -6,5 +6,83 @@ TWILIO_ACCOUNT_SID = os.getenv('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = os.getenv('TWILIO_AUTH_TOKEN')
 TWILIO_PHONE_NUMBER = os.getenv('TWILIO_PHONE_NUMBER') # Your Twilio phone number
 TWILIO_WHATSAPP_NUMBER = os.getenv('TWILIO_WHATSAPP_NUMBER') # Your Twilio WhatsApp enabled number (e.g., 'whatsapp:+1234567890')
-# Git Automation
-GIT_PAT = os.getenv('GIT_PAT')
+# Public URL of the web app; Twilio fetches voice notes and call TwiML from it
+PUBLIC_BASE_URL = os.getenv('PUBLIC_BASE_URL', 'http://localhost:5000').rstrip('/')
+# Sends Twilio API calls somewhere other than api.twilio.com (e.g. benchmarks/stub_servers.py)
+TWILIO_API_URL = os.getenv('TWILIO_API_URL', '').rstrip('/')
+
+# Scripture cache (in-process LRU in front of a SQLite tier shared by all workers)
+CACHE_DB_NAME = os.getenv('CACHE_DB_NAME', 'bible_cache.db')
+CACHE_MEMORY_ENTRIES = int(os.getenv('CACHE_MEMORY_ENTRIES', '512'))
+CACHE_DISK_ENTRIES = int(os.getenv('CACHE_DISK_ENTRIES', '20000'))
+CACHE_TTL_SECONDS = int(os.getenv('CACHE_TTL_SECONDS', str(30 * 24 * 3600))) # Scripture text doesn't change
+CACHE_STALE_SECONDS = int(os.getenv('CACHE_STALE_SECONDS', str(7 * 24 * 3600))) # Served while refreshing in the background
+
+# Locally ingested translations (see corpus.py)
+CORPUS_DB_NAME = os.getenv('CORPUS_DB_NAME', 'bible_corpus.db')
+
+# bible-api.com upstream client (see upstream.py)
+BIBLE_API_URL = os.getenv('BIBLE_API_URL', 'https://bible-api.com')
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', '3.05'))
+UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', '10'))
+UPSTREAM_RETRIES = int(os.getenv('UPSTREAM_RETRIES', '2'))
+UPSTREAM_BACKOFF_SECONDS = float(os.getenv('UPSTREAM_BACKOFF_SECONDS', '0.5'))
+UPSTREAM_MAX_CONCURRENCY = int(os.getenv('UPSTREAM_MAX_CONCURRENCY', '8')) # Per process
+UPSTREAM_BREAKER_THRESHOLD = int(os.getenv('UPSTREAM_BREAKER_THRESHOLD', '5')) # Consecutive failures before opening
+UPSTREAM_BREAKER_RESET_SECONDS = float(os.getenv('UPSTREAM_BREAKER_RESET_SECONDS', '30'))
+
+# Delivery engine (see delivery.py)
+DELIVERY_WORKERS = int(os.getenv('DELIVERY_WORKERS', '16'))
+DELIVERY_CHUNK_SIZE = int(os.getenv('DELIVERY_CHUNK_SIZE', '1000')) # Users held in memory at once per bucket
+
+# Outbox dispatch (see outbox.py). Rates are messages per second per sender
+# number and channel, per dispatcher process.
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '4'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '6'))
+OUTBOX_RETRY_BASE_SECONDS = float(os.getenv('OUTBOX_RETRY_BASE_SECONDS', '30'))
+OUTBOX_LEASE_SECONDS = float(os.getenv('OUTBOX_LEASE_SECONDS', '120'))
+SMS_SEND_RATE = float(os.getenv('SMS_SEND_RATE', '1')) # Twilio's long-code default
+WHATSAPP_SEND_RATE = float(os.getenv('WHATSAPP_SEND_RATE', '20'))
+VOICE_CALL_RATE = float(os.getenv('VOICE_CALL_RATE', '1'))
+
+# Rendered voice notes (see audio.py). Served by the web app's /media route, so
+# the scheduler and web service must share this directory (e.g. the Render disk).
+MEDIA_DIR = os.getenv('MEDIA_DIR', 'media')
+MEDIA_CACHE_MAX_BYTES = int(os.getenv('MEDIA_CACHE_MAX_BYTES', str(500 * 1024 * 1024)))
+AUDIO_WORKERS = int(os.getenv('AUDIO_WORKERS', '2'))
+
+# Side-by-side compare view
+COMPARE_WORKERS = int(os.getenv('COMPARE_WORKERS', '8'))
+COMPARE_TIMEOUT_SECONDS = float(os.getenv('COMPARE_TIMEOUT_SECONDS', '8'))
+COMPARE_MAX_TRANSLATIONS = int(os.getenv('COMPARE_MAX_TRANSLATIONS', '6'))
+
+# Reader prefetch of adjacent chapters (see prefetch.py)
+PREFETCH_ENABLED = os.getenv('PREFETCH_ENABLED', '1') == '1'
+PREFETCH_WORKERS = int(os.getenv('PREFETCH_WORKERS', '2'))
+PREFETCH_MAX_PENDING = int(os.getenv('PREFETCH_MAX_PENDING', '32'))
+PREFETCH_WINDOW_SECONDS = int(os.getenv('PREFETCH_WINDOW_SECONDS', '1800')) # Unused after this long counts as wasted
+
+# Rendered template fragments for the reader (see fragments.py)
+FRAGMENT_CACHE_ENTRIES = int(os.getenv('FRAGMENT_CACHE_ENTRIES', '4096'))
+
+# Whole-book / reading-plan downloads (see book_export.py). Each export keeps
+# EXPORT_READ_AHEAD chapters in flight on a shared pool of EXPORT_WORKERS threads.
+EXPORT_WORKERS = int(os.getenv('EXPORT_WORKERS', '8'))
+EXPORT_READ_AHEAD = int(os.getenv('EXPORT_READ_AHEAD', '4'))
+EXPORT_MAX_CHAPTERS = int(os.getenv('EXPORT_MAX_CHAPTERS', '300'))
+
+# "random" verse preferences (see references.random_reference). 'daily' gives
+# each day RANDOM_VERSE_VARIANTS verses shared out among all users, so a bucket
+# only fetches a handful; 'user' picks per user per day; 'uniform' is fresh on every send.
+RANDOM_VERSE_MODE = os.getenv('RANDOM_VERSE_MODE', 'daily')
+RANDOM_VERSE_VARIANTS = int(os.getenv('RANDOM_VERSE_VARIANTS', '8'))
+
+# Bearer token for the /admin API (bulk user import/export, see bulk_users.py);
+# the admin routes are disabled while it is unset
+ADMIN_API_TOKEN = os.getenv('ADMIN_API_TOKEN', '')
+
+# Metrics (see metrics.py). The web app serves /metrics itself; the scheduler
+# serves it on METRICS_PORT when set. TRACE_DELIVERIES=1 prints the per-stage
+# timings of every send_daily_verse.
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+TRACE_DELIVERIES = os.getenv('TRACE_DELIVERIES', '0') == '1'
@@ -0,0 +1,266 @@
+import argparse
+import json
+import os
+import re
+import sqlite3
+import threading
+import time
+import xml.etree.ElementTree as ET
+from config import CORPUS_DB_NAME
+from metrics import SQLITE_SECONDS, timed
+from references import BOOK_CODES, InvalidReference, book_index, parse_reference
+
+INSERT_BATCH = 5000
+_local = threading.local()
+_ingested = {"ids": set(), "loaded_at": 0.0}
+INGESTED_REFRESH_SECONDS = 60 # Pick up translations ingested by another process
+
+def get_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(CORPUS_DB_NAME, timeout=5)
+        conn.execute("PRAGMA journal_mode=WAL") # Web readers don't block ingestion/indexing
+        conn.execute("PRAGMA synchronous=NORMAL")
+        _local.conn = conn
+    return conn
+
+def init_corpus(conn=None):
+    conn = conn or get_connection()
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS translations (
+            id TEXT PRIMARY KEY, -- lowercase translation id, e.g. 'kjv'
+            name TEXT NOT NULL,
+            verse_count INTEGER NOT NULL,
+            ingested_at REAL NOT NULL
+        )
+    ''')
+    # Clustered on the lookup key, so a chapter read is a single range scan
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS verses (
+            translation TEXT NOT NULL,
+            book INTEGER NOT NULL, -- index into BOOK_CODES
+            chapter INTEGER NOT NULL,
+            verse INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            PRIMARY KEY (translation, book, chapter, verse)
+        ) WITHOUT ROWID
+    ''')
+    conn.commit()
+
+# --- Parsers: each yields (book_index, chapter, verse, text) ---
+
+def parse_json(path):
+    # Accepts bible-api style {"verses": [...]} or a bare list of verse objects
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    verses = data["verses"] if isinstance(data, dict) else data
+    for v in verses:
+        book = book_index(v.get("book_name") or v.get("book") or v.get("book_id", ""))
+        if book is None:
+            print(f"Skipping verse with unknown book: {v}")
+            continue
+        yield book, int(v["chapter"]), int(v["verse"]), v["text"].strip()
+
+_OSIS_SKIP = {"note", "title", "reference"}
+
+def _osis_id(value):
+    # "Gen.1.1" (possibly "Gen.1.1 Gen.1.2" for merged verses) -> (book, chapter, verse)
+    parts = value.split()[0].split(".")
+    if len(parts) != 3:
+        return None
+    book = book_index(parts[0])
+    if book is None:
+        return None
+    return book, int(parts[1]), int(parts[2])
+
+def parse_osis(path):
+    # Handles both container <verse osisID>text</verse> and milestone
+    # <verse sID/>text<verse eID/> markup.
+    root = ET.parse(path).getroot()
+    out = []
+    state = {"id": None, "parts": []}
+
+    def flush():
+        if state["id"] is not None:
+            text = re.sub(r"\s+", " ", "".join(state["parts"])).strip()
+            if text:
+                out.append(state["id"] + (text,))
+        state["id"], state["parts"] = None, []
+
+    def walk(elem):
+        tag = elem.tag.rsplit("}", 1)[-1]
+        container = False
+        if tag == "verse":
+            if elem.get("eID"):
+                flush()
+            elif elem.get("osisID"):
+                flush()
+                state["id"] = _osis_id(elem.get("osisID"))
+                container = not elem.get("sID")
+        if tag not in _OSIS_SKIP:
+            if elem.text and state["id"] is not None:
+                state["parts"].append(elem.text)
+            for child in elem:
+                walk(child)
+        if container:
+            flush()
+        if elem.tail and state["id"] is not None:
+            state["parts"].append(elem.tail)
+
+    walk(root)
+    flush()
+    return out
+
+_USFM_NOTES = re.compile(r"\\(f|x|fe)\s.*?\\\1\*")
+_USFM_WORD = re.compile(r"\\\+?w\s+([^|\\]*)(\|[^\\]*)?\\\+?w\*")
+_USFM_MARKER = re.compile(r"\\\+?[a-z0-9]+\*?\s?")
+_USFM_PARAGRAPH = re.compile(r"^\\(p|m|nb|q\d?|pi\d?|li\d?)\s+(?=\\v )") # "\p \v 1 ..." on one line
+
+def _usfm_text(text):
+    text = _USFM_NOTES.sub("", text)
+    text = _USFM_WORD.sub(r"\1", text)
+    return _USFM_MARKER.sub("", text)
+
+def parse_usfm(path):
+    # One book per file: \id GEN, \c 1, \v 1 In the beginning...
+    book, chapter, verse, parts = None, None, None, []
+    out = []
+
+    def flush():
+        if verse is not None and parts:
+            text = re.sub(r"\s+", " ", " ".join(parts)).strip()
+            if text:
+                out.append((book, chapter, verse, text))
+
+    with open(path, encoding="utf-8-sig") as f:
+        for line in f:
+            line = _USFM_PARAGRAPH.sub("", line.strip())
+            if line.startswith("\\id "):
+                flush()
+                book, chapter, verse, parts = book_index(line.split()[1]), None, None, []
+            elif line.startswith("\\c "):
+                flush()
+                chapter, verse, parts = int(line.split()[1]), None, []
+            elif line.startswith("\\v "):
+                flush()
+                _, number, *rest = line.split(" ", 2) + [""]
+                verse, parts = int(re.match(r"\d+", number).group()), [_usfm_text(" ".join(rest))]
+            elif verse is not None and line and not line.startswith(("\\s", "\\ms", "\\mt", "\\h ", "\\toc")):
+                parts.append(_usfm_text(line)) # Continuation (poetry/paragraph lines)
+    flush()
+    if book is None:
+        print(f"No \\id line found in {path}; skipped.")
+        return []
+    return out
+
+PARSERS = {"json": parse_json, "osis": parse_osis, "usfm": parse_usfm}
+
+def _detect_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".json":
+        return "json"
+    if ext in (".xml", ".osis"):
+        return "osis"
+    return "usfm"
+
+def ingest(translation, paths, fmt=None, name=None):
+    translation = translation.lower()
+    conn = get_connection()
+    init_corpus(conn)
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(os.path.join(path, f) for f in os.listdir(path)))
+        else:
+            files.append(path)
+
+    started = time.time()
+    with conn: # One transaction: a half-ingested translation is never visible
+        conn.execute("DELETE FROM verses WHERE translation = ?", (translation,))
+        batch = []
+        for path in files:
+            for book, chapter, verse, text in PARSERS[fmt or _detect_format(path)](path):
+                batch.append((translation, book, chapter, verse, text))
+                if len(batch) >= INSERT_BATCH:
+                    conn.executemany("INSERT OR REPLACE INTO verses VALUES (?, ?, ?, ?, ?)", batch)
+                    batch = []
+        if batch:
+            conn.executemany("INSERT OR REPLACE INTO verses VALUES (?, ?, ?, ?, ?)", batch)
+        count = conn.execute("SELECT COUNT(*) FROM verses WHERE translation = ?", (translation,)).fetchone()[0]
+        conn.execute("INSERT OR REPLACE INTO translations (id, name, verse_count, ingested_at) VALUES (?, ?, ?, ?)",
+                     (translation, name or translation.upper(), count, time.time()))
+    _ingested["loaded_at"] = 0.0
+    from search import index_translation # search imports this module
+    index_translation(translation)
+    print(f"Ingested {count} verses for {translation} from {len(files)} file(s) in {time.time() - started:.1f}s")
+    return count
+
+def ingested_translations():
+    now = time.time()
+    if now - _ingested["loaded_at"] > INGESTED_REFRESH_SECONDS:
+        try:
+            rows = get_connection().execute("SELECT id FROM translations").fetchall()
+            _ingested["ids"] = {row[0] for row in rows}
+        except sqlite3.OperationalError:
+            _ingested["ids"] = set() # Nothing ingested yet
+        _ingested["loaded_at"] = now
+    return _ingested["ids"]
+
+@timed(SQLITE_SECONDS, db="corpus", op="passage")
+def _passage(translation, book, chapter, first_verse=None, last_verse=None):
+    conn = get_connection()
+    if first_verse is None:
+        rows = conn.execute("SELECT verse, text FROM verses WHERE translation = ? AND book = ? AND chapter = ? ORDER BY verse",
+                            (translation, book, chapter)).fetchall()
+    else:
+        rows = conn.execute("SELECT verse, text FROM verses WHERE translation = ? AND book = ? AND chapter = ? AND verse BETWEEN ? AND ? ORDER BY verse",
+                            (translation, book, chapter, first_verse, last_verse)).fetchall()
+    if not rows:
+        return None
+    name = conn.execute("SELECT name FROM translations WHERE id = ?", (translation,)).fetchone()
+    book_name = BOOK_CODES[book][0]
+    # Same shape as a bible-api.com response, so callers don't care where it came from
+    return {
+        "translation_name": name[0] if name else translation.upper(),
+        "verses": [{"book_name": book_name, "chapter": chapter, "verse": verse, "text": text} for verse, text in rows],
+    }
+
+def get_local_chapter(translation, book_name, chapter_number):
+    translation = translation.lower()
+    if translation not in ingested_translations():
+        return None
+    book = book_index(book_name)
+    if book is None:
+        return None
+    return _passage(translation, book, int(chapter_number))
+
+def get_local_passage(translation, reference):
+    # "john 3:16", "jn 3:16-18" or "psalm 23"
+    translation = translation.lower()
+    if translation not in ingested_translations():
+        return None
+    try:
+        ref = parse_reference(reference, translation)
+    except InvalidReference:
+        return None
+    if ref.verse is None:
+        return _passage(translation, ref.book, ref.chapter)
+    return _passage(translation, ref.book, ref.chapter, ref.verse, ref.end_verse or ref.verse)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load whole Bible translations into the local corpus.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    ingest_cmd = sub.add_parser("ingest", help="Ingest OSIS/USFM/JSON files for one translation")
+    ingest_cmd.add_argument("translation", help="Translation id, e.g. kjv")
+    ingest_cmd.add_argument("paths", nargs="+", help="Files or directories (USFM is usually one file per book)")
+    ingest_cmd.add_argument("--format", choices=sorted(PARSERS), help="Defaults to guessing from the file extension")
+    ingest_cmd.add_argument("--name", help="Display name, e.g. 'King James Version'")
+    sub.add_parser("list", help="Show ingested translations")
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        ingest(args.translation, args.paths, args.format, args.name)
+    else:
+        init_corpus()
+        for row in get_connection().execute("SELECT id, name, verse_count FROM translations ORDER BY id"):
+            print(f"{row[0]:<12} {row[2]:>6} verses  {row[1]}")
@@ -1,9 +1,41 @@
+import os
 import sqlite3
+import sys
+import threading
+import time
+from metrics import SQLITE_SECONDS, timed
+
+DATABASE_NAME = os.getenv("DATABASE_NAME", "bible_app.db")
+BUSY_TIMEOUT_MS = 5000
+MMAP_SIZE = 64 * 1024 * 1024
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+
+def get_connection():
+    # One long-lived connection per thread (and per process: a connection
+    # inherited across a gunicorn fork is never reused).
+    conn = getattr(_local, "conn", None)
+    if conn is None or _local.pid != os.getpid():
+        conn = sqlite3.connect(DATABASE_NAME, timeout=BUSY_TIMEOUT_MS / 1000, cached_statements=STATEMENT_CACHE_SIZE)
+        conn.execute("PRAGMA journal_mode=WAL") # Readers and the writer no longer block each other
+        conn.execute("PRAGMA synchronous=NORMAL") # Durable at checkpoints; safe with WAL
+        conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        conn.execute("PRAGMA foreign_keys=ON")
+        _local.conn = conn
+        _local.pid = os.getpid()
+    return conn
+
+def close_connection():
+    conn = getattr(_local, "conn", None)
+    if conn is not None:
+        conn.close()
+        _local.conn = None
 
-DATABASE_NAME = "bible_app.db"
 
 def init_db():
-    conn = sqlite3.connect(DATABASE_NAME)
+    conn = get_connection()
     c = conn.cursor()
     c.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -15,45 +47,186 @@ def init_db():
             verse_of_day_preference TEXT NOT NULL -- Storing verse reference like 'john 3:16'
         )
     ''')
+    # Append-only log of preference changes, so the scheduler can apply edits incrementally
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS user_changes (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            phone_number TEXT NOT NULL,
+            changed_at REAL NOT NULL
+        )
+    ''')
+    # Durable queue of outgoing Twilio sends, drained by outbox.py
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT UNIQUE NOT NULL, -- e.g. '2024-05-01:+1234567890:sms', so re-runs don't double send
+            phone_number TEXT NOT NULL,
+            channel TEXT NOT NULL, -- 'sms', 'whatsapp_text', 'whatsapp_voice_note' or 'call'
+            payload TEXT NOT NULL, -- JSON: body / media_url / twiml_url
+            status TEXT NOT NULL DEFAULT 'pending', -- 'pending', 'sending', 'sent' or 'dead'
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            lease_until REAL, -- A 'sending' row whose lease expired was claimed by a worker that died
+            provider_sid TEXT,
+            last_error TEXT,
+            created_at REAL NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (status, next_attempt_at)")
     conn.commit()
-    conn.close()
+    migrate()
+
+# --- Schema migrations, tracked in PRAGMA user_version ---
 
+def _migration_1_user_translations(c):
+    # users.bible_id held a comma-separated list; move it into a join table
+    c.execute('''
+        CREATE TABLE user_translations (
+            user_id INTEGER NOT NULL REFERENCES users (id) ON DELETE CASCADE,
+            position INTEGER NOT NULL, -- Order the user picked them in
+            translation TEXT NOT NULL, -- e.g. 'kjv'
+            PRIMARY KEY (user_id, position)
+        )
+    ''')
+    c.execute("SELECT id, bible_id FROM users")
+    rows = [(user_id, position, translation.strip())
+            for user_id, bible_id in c.fetchall()
+            for position, translation in enumerate(t for t in (bible_id or "").split(",") if t.strip())]
+    c.executemany("INSERT INTO user_translations (user_id, position, translation) VALUES (?, ?, ?)", rows)
+    c.execute("ALTER TABLE users DROP COLUMN bible_id")
+    # The scheduler selects users by delivery time and channel
+    c.execute("CREATE INDEX idx_users_delivery_time ON users (delivery_time)")
+    c.execute("CREATE INDEX idx_users_preferred_method ON users (preferred_method)")
+
+MIGRATIONS = [_migration_1_user_translations]
+
+def get_schema_version():
+    return get_connection().execute("PRAGMA user_version").fetchone()[0]
+
+def migrate():
+    # Applies pending migrations one transaction each. Safe to call from every
+    # worker at startup: BEGIN IMMEDIATE serializes them and the version is
+    # re-read under the lock.
+    conn = get_connection()
+    applied = []
+    for version, migration in enumerate(MIGRATIONS, start=1):
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE")
+        try:
+            if c.execute("PRAGMA user_version").fetchone()[0] < version:
+                migration(c)
+                c.execute(f"PRAGMA user_version = {version}")
+                applied.append(migration.__name__)
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            raise
+    return applied
+
+def _record_change(c, phone_number):
+    # Written in the same transaction as the change itself
+    c.execute("INSERT INTO user_changes (phone_number, changed_at) VALUES (?, ?)", (phone_number, time.time()))
+
+def _set_translations(c, user_id, bible_ids_str):
+    c.execute("DELETE FROM user_translations WHERE user_id = ?", (user_id,))
+    translations = [t.strip() for t in bible_ids_str.split(",") if t.strip()]
+    c.executemany("INSERT INTO user_translations (user_id, position, translation) VALUES (?, ?, ?)",
+                  [(user_id, position, translation) for position, translation in enumerate(translations)])
+
+@timed(SQLITE_SECONDS, db="users")
 def add_user(phone_number, preferred_method, delivery_time, bible_ids_str, verse_of_day_preference):
-    conn = sqlite3.connect(DATABASE_NAME)
-    c = conn.cursor()
+    conn = get_connection()
     try:
-        c.execute("INSERT INTO users (phone_number, preferred_method, delivery_time, bible_id, verse_of_day_preference) VALUES (?, ?, ?, ?, ?)",
-                  (phone_number, preferred_method, delivery_time, bible_ids_str, verse_of_day_preference))
-        conn.commit()
+        with conn: # Commits on success, rolls back on error
+            c = conn.cursor()
+            c.execute("INSERT INTO users (phone_number, preferred_method, delivery_time, verse_of_day_preference) VALUES (?, ?, ?, ?)",
+                      (phone_number, preferred_method, delivery_time, verse_of_day_preference))
+            _set_translations(c, c.lastrowid, bible_ids_str)
+            _record_change(c, phone_number)
         return True
     except sqlite3.IntegrityError:
         print(f"User with phone number {phone_number} already exists.")
         return False
-    finally:
-        conn.close()
 
+@timed(SQLITE_SECONDS, db="users")
+def save_user_preferences(phone_number, preferred_method, delivery_time, bible_ids_str, verse_of_day_preference):
+    # Insert-or-update in one transaction; returns True if the user was new
+    conn = get_connection()
+    with conn:
+        c = conn.cursor()
+        # sqlite3 would only BEGIN at the INSERT; take the write lock before the
+        # existence check so a concurrent save can't slip in between
+        c.execute("BEGIN IMMEDIATE")
+        c.execute("SELECT 1 FROM users WHERE phone_number = ?", (phone_number,))
+        existed = c.fetchone() is not None
+        c.execute("""INSERT INTO users (phone_number, preferred_method, delivery_time, verse_of_day_preference) VALUES (?, ?, ?, ?)
+                     ON CONFLICT (phone_number) DO UPDATE SET preferred_method = excluded.preferred_method, delivery_time = excluded.delivery_time,
+                     verse_of_day_preference = excluded.verse_of_day_preference
+                     RETURNING id""",
+                  (phone_number, preferred_method, delivery_time, verse_of_day_preference))
+        _set_translations(c, c.fetchone()[0], bible_ids_str)
+        _record_change(c, phone_number)
+    return not existed
+
+def _user_ids(c, phone_numbers):
+    # phone_number -> id, in chunks that stay under SQLite's bound-parameter limit
+    ids = {}
+    for start in range(0, len(phone_numbers), 500):
+        chunk = phone_numbers[start:start + 500]
+        c.execute(f"SELECT phone_number, id FROM users WHERE phone_number IN ({','.join('?' * len(chunk))})", chunk)
+        ids.update(c.fetchall())
+    return ids
+
+@timed(SQLITE_SECONDS, db="users")
+def upsert_users(rows):
+    # Bulk save_user_preferences: rows are (phone_number, preferred_method,
+    # delivery_time, [translations], verse_of_day_preference), written with a
+    # handful of executemany calls in one transaction. Returns (created, updated).
+    rows = list({row[0]: row for row in rows}.values()) # Last row wins for a repeated number
+    phone_numbers = [row[0] for row in rows]
+    conn = get_connection()
+    with conn:
+        c = conn.cursor()
+        c.execute("BEGIN IMMEDIATE") # As in save_user_preferences: `existing` must still hold at the upsert
+        existing = _user_ids(c, phone_numbers)
+        c.executemany("""INSERT INTO users (phone_number, preferred_method, delivery_time, verse_of_day_preference) VALUES (?, ?, ?, ?)
+                         ON CONFLICT (phone_number) DO UPDATE SET preferred_method = excluded.preferred_method, delivery_time = excluded.delivery_time,
+                         verse_of_day_preference = excluded.verse_of_day_preference""",
+                      [(phone, method, delivery_time, verse) for phone, method, delivery_time, _, verse in rows])
+        ids = dict(existing, **_user_ids(c, [phone for phone in phone_numbers if phone not in existing]))
+        c.executemany("DELETE FROM user_translations WHERE user_id = ?", [(ids[phone],) for phone in existing])
+        c.executemany("INSERT INTO user_translations (user_id, position, translation) VALUES (?, ?, ?)",
+                      [(ids[row[0]], position, translation) for row in rows for position, translation in enumerate(row[3])])
+        now = time.time()
+        c.executemany("INSERT INTO user_changes (phone_number, changed_at) VALUES (?, ?)", [(phone, now) for phone in phone_numbers])
+    return len(rows) - len(existing), len(existing)
+
+# Translations come back joined in the user's order, as one ',' separated column
+USER_COLUMNS = """u.id, u.phone_number, u.preferred_method, u.delivery_time, u.verse_of_day_preference,
+    (SELECT group_concat(translation, ',') FROM (SELECT translation FROM user_translations WHERE user_id = u.id ORDER BY position))"""
+
+def _row_to_user(user):
+    return {
+        "id": user[0],
+        "phone_number": user[1],
+        "preferred_method": user[2],
+        "delivery_time": user[3],
+        "bible_id": user[5].split(',') if user[5] else [], # List of translation IDs
+        "verse_of_day_preference": user[4]
+    }
+
+@timed(SQLITE_SECONDS, db="users")
 def get_user_preferences(phone_number):
-    conn = sqlite3.connect(DATABASE_NAME)
-    c = conn.cursor()
-    c.execute("SELECT * FROM users WHERE phone_number = ?", (phone_number,))
+    c = get_connection().cursor()
+    c.execute(f"SELECT {USER_COLUMNS} FROM users u WHERE u.phone_number = ?", (phone_number,))
     user = c.fetchone()
-    conn.close()
     if user:
-        # Split the comma-separated string back into a list of translation IDs
-        bible_ids_list = user[4].split(',') if user[4] else []
-        return {
-            "id": user[0],
-            "phone_number": user[1],
-            "preferred_method": user[2],
-            "delivery_time": user[3],
-            "bible_id": bible_ids_list, # Now returns a list
-            "verse_of_day_preference": user[5]
-        }
+        return _row_to_user(user)
     return None
 
+@timed(SQLITE_SECONDS, db="users")
 def update_user_preferences(phone_number, preferred_method=None, delivery_time=None, bible_ids_str=None, verse_of_day_preference=None):
-    conn = sqlite3.connect(DATABASE_NAME)
-    c = conn.cursor()
     updates = []
     params = []
     if preferred_method: 
@@ -62,57 +235,181 @@ def update_user_preferences(phone_number, preferred_method=None, delivery_time=N
     if delivery_time:
         updates.append("delivery_time = ?")
         params.append(delivery_time)
-    if bible_ids_str is not None: # Use is not None to allow empty string
-        updates.append("bible_id = ?")
-        params.append(bible_ids_str)
     if verse_of_day_preference:
         updates.append("verse_of_day_preference = ?")
         params.append(verse_of_day_preference)
     
-    if not updates:
-        conn.close()
+    if not updates and bible_ids_str is None: # Use is not None to allow empty string
         return False
 
-    params.append(phone_number)
-    set_clause = ", ".join(updates)
-    c.execute(f"UPDATE users SET {set_clause} WHERE phone_number = ?", tuple(params))
-    conn.commit()
-    conn.close()
+    conn = get_connection()
+    with conn:
+        c = conn.cursor()
+        if updates:
+            set_clause = ", ".join(updates)
+            c.execute(f"UPDATE users SET {set_clause} WHERE phone_number = ?", tuple(params + [phone_number]))
+        if bible_ids_str is not None:
+            c.execute("SELECT id FROM users WHERE phone_number = ?", (phone_number,))
+            row = c.fetchone()
+            if row:
+                _set_translations(c, row[0], bible_ids_str)
+        _record_change(c, phone_number)
     return True
 
+@timed(SQLITE_SECONDS, db="users")
 def delete_user(phone_number):
-    conn = sqlite3.connect(DATABASE_NAME)
-    c = conn.cursor()
-    c.execute("DELETE FROM users WHERE phone_number = ?", (phone_number,))
-    conn.commit()
-    conn.close()
+    conn = get_connection()
+    with conn:
+        c = conn.cursor()
+        c.execute("DELETE FROM users WHERE phone_number = ?", (phone_number,))
+        _record_change(c, phone_number)
     return True
 
 def get_all_users():
-    conn = sqlite3.connect(DATABASE_NAME)
+    return list(iter_users())
+
+def iter_users(delivery_time=None, preferred_method=None, batch_size=500):
+    # Streams users in id order, one short keyset-paginated query per batch, so
+    # memory stays flat and no read snapshot is held open between batches.
+    filters = ["u.id > ?"]
+    params = []
+    if delivery_time is not None:
+        filters.append("u.delivery_time = ?") # idx_users_delivery_time
+        params.append(delivery_time)
+    if preferred_method is not None:
+        filters.append("u.preferred_method = ?") # idx_users_preferred_method
+        params.append(preferred_method)
+    query = f"SELECT {USER_COLUMNS} FROM users u WHERE {' AND '.join(filters)} ORDER BY u.id LIMIT ?"
+    last_id = 0
+    while True:
+        with SQLITE_SECONDS.time(db="users", op="iter_users"):
+            rows = get_connection().execute(query, [last_id] + params + [batch_size]).fetchall()
+        for row in rows:
+            yield _row_to_user(row)
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1][0]
+
+@timed(SQLITE_SECONDS, db="users")
+def get_delivery_times():
+    # Distinct delivery times, straight off idx_users_delivery_time
+    c = get_connection().cursor()
+    c.execute("SELECT DISTINCT delivery_time FROM users ORDER BY delivery_time")
+    return [row[0] for row in c.fetchall()]
+
+@timed(SQLITE_SECONDS, db="users")
+def has_users_at(delivery_time):
+    c = get_connection().cursor()
+    c.execute("SELECT EXISTS (SELECT 1 FROM users WHERE delivery_time = ?)", (delivery_time,))
+    return bool(c.fetchone()[0])
+
+@timed(SQLITE_SECONDS, db="users")
+def get_user_changes(after_id):
+    # Phone numbers changed since journal position `after_id`, and the new position
+    c = get_connection().cursor()
+    c.execute("SELECT id, phone_number FROM user_changes WHERE id > ? ORDER BY id", (after_id,))
+    rows = c.fetchall()
+    if not rows:
+        return [], after_id
+    return list(dict.fromkeys(row[1] for row in rows)), rows[-1][0]
+
+@timed(SQLITE_SECONDS, db="users")
+def get_last_change_id():
+    c = get_connection().cursor()
+    c.execute("SELECT COALESCE(MAX(id), 0) FROM user_changes")
+    return c.fetchone()[0]
+
+@timed(SQLITE_SECONDS, db="users")
+def prune_user_changes(older_than_seconds):
+    conn = get_connection()
+    with conn:
+        conn.execute("DELETE FROM user_changes WHERE changed_at < ?", (time.time() - older_than_seconds,))
+
+@timed(SQLITE_SECONDS, db="users")
+def enqueue_delivery(idempotency_key, phone_number, channel, payload_json):
+    conn = get_connection()
+    now = time.time()
+    with conn:
+        c = conn.cursor()
+        c.execute("INSERT OR IGNORE INTO outbox (idempotency_key, phone_number, channel, payload, next_attempt_at, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                  (idempotency_key, phone_number, channel, payload_json, now, now, now))
+    return c.rowcount == 1 # 0 means this delivery was already queued
+
+@timed(SQLITE_SECONDS, db="users")
+def claim_deliveries(limit, lease_seconds):
+    # Atomically hand out due rows, including ones left 'sending' by a crashed worker
+    conn = get_connection()
     c = conn.cursor()
-    c.execute("SELECT * FROM users")
-    users_data = c.fetchall()
-    conn.close()
-    users = []
-    for user in users_data:
-        bible_ids_list = user[4].split(',') if user[4] else []
-        users.append({
-            "id": user[0],
-            "phone_number": user[1],
-            "preferred_method": user[2],
-            "delivery_time": user[3],
-            "bible_id": bible_ids_list, # Now returns a list
-            "verse_of_day_preference": user[5]
-        })
-    return users
+    now = time.time()
+    try:
+        c.execute("BEGIN IMMEDIATE") # Take the write lock up front so two workers can't claim the same rows
+        c.execute("""SELECT id, idempotency_key, phone_number, channel, payload, attempts FROM outbox
+                     WHERE (status = 'pending' AND next_attempt_at <= ?) OR (status = 'sending' AND lease_until < ?)
+                     ORDER BY next_attempt_at LIMIT ?""", (now, now, limit))
+        rows = c.fetchall()
+        if rows:
+            c.executemany("UPDATE outbox SET status = 'sending', lease_until = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                          [(now + lease_seconds, now, row[0]) for row in rows])
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return [{
+        "id": row[0],
+        "idempotency_key": row[1],
+        "phone_number": row[2],
+        "channel": row[3],
+        "payload": row[4],
+        "attempts": row[5] + 1,
+    } for row in rows]
+
+@timed(SQLITE_SECONDS, db="users")
+def renew_delivery_lease(delivery_id, attempts, lease_seconds):
+    # Re-leases a claimed row right before it is sent. False means the lease ran
+    # out and another worker reclaimed the row (its attempts moved on), so this
+    # worker must not send it.
+    conn = get_connection()
+    now = time.time()
+    with conn:
+        c = conn.execute("UPDATE outbox SET lease_until = ?, updated_at = ? WHERE id = ? AND status = 'sending' AND attempts = ?",
+                         (now + lease_seconds, now, delivery_id, attempts))
+    return c.rowcount == 1
+
+@timed(SQLITE_SECONDS, db="users")
+def mark_delivery_sent(delivery_id, provider_sid):
+    conn = get_connection()
+    with conn:
+        conn.execute("UPDATE outbox SET status = 'sent', provider_sid = ?, lease_until = NULL, updated_at = ? WHERE id = ?",
+                     (provider_sid, time.time(), delivery_id))
+
+@timed(SQLITE_SECONDS, db="users")
+def mark_delivery_failed(delivery_id, error, retry_at=None):
+    # retry_at=None gives up on the row ('dead'); otherwise it goes back to 'pending'
+    conn = get_connection()
+    status = "pending" if retry_at is not None else "dead"
+    with conn:
+        conn.execute("UPDATE outbox SET status = ?, next_attempt_at = COALESCE(?, next_attempt_at), lease_until = NULL, last_error = ?, updated_at = ? WHERE id = ?",
+                     (status, retry_at, str(error)[:500], time.time(), delivery_id))
+
+@timed(SQLITE_SECONDS, db="users")
+def get_outbox_counts():
+    c = get_connection().cursor()
+    c.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status")
+    return dict(c.fetchall())
 
 if __name__ == "__main__":
+    if sys.argv[1:] == ["migrate"]:
+        # python database.py migrate
+        print(f"Schema version {get_schema_version()}")
+        init_db()
+        print(f"Schema version {get_schema_version()} ({len(MIGRATIONS)} migrations known)")
+        sys.exit(0)
+
     init_db()
     print("Database initialized and user table created.")
 
     # Example Usage
-    # The database schema has changed for bible_id to be a comma-separated string
+    # Translations are passed as a comma-separated string and stored in user_translations
     add_user("+1234567890", "sms", "08:00", "KJV,WEB", "john 3:16") # Example with multiple translations
     update_user_preferences("+1234567890", preferred_method="call", delivery_time="09:30", bible_ids_str="KJV,ASV") # Example update
     
@@ -0,0 +1,348 @@
+import heapq
+import os
+import random
+import time
+import zlib
+from datetime import date
+from urllib.parse import urlencode
+from concurrent.futures import ThreadPoolExecutor
+from config import (DELIVERY_WORKERS, DELIVERY_CHUNK_SIZE, PUBLIC_BASE_URL, RANDOM_VERSE_MODE, RANDOM_VERSE_VARIANTS,
+                    METRICS_PORT, TRACE_DELIVERIES)
+from metrics import DELIVERY_STAGE_SECONDS, BUCKET_STAGE_SECONDS, Spans, register_stats, start_http_server
+from outbox import OutboxDispatcher, enqueue
+from references import InvalidReference, parse_reference, random_reference, seeded_rng
+from database import (init_db, iter_users, get_user_preferences, get_delivery_times, has_users_at, get_user_changes,
+                      get_last_change_id, prune_user_changes, get_outbox_counts)
+from audio import render_audio, render_many
+from cache import cache_stats
+from upstream import upstream_stats
+from utils import get_random_verse, format_daily_message
+
+bucket_reports = [] # Most recent run of each bucket, newest last
+MAX_REPORTS = 200
+JOURNAL_RETENTION_SECONDS = 7 * 86400
+
+def generate_voice_note(text, lang="en"):
+    # Rendered once per distinct text into the content-addressed media cache
+    try:
+        return render_audio(text, lang)
+    except Exception as e:
+        print(f"Error generating voice note: {e}")
+        return None
+
+DEFAULT_REFERENCE = "John 3:16"
+
+def random_verse_rng(user, day=None):
+    # Seeded per day (and per user or per group of users) so every process
+    # picks the same verse for a user on a given day
+    day = (day or date.today()).isoformat()
+    if RANDOM_VERSE_MODE == "user":
+        return seeded_rng(day, user["phone_number"])
+    if RANDOM_VERSE_MODE == "daily":
+        return seeded_rng(day, zlib.crc32(user["phone_number"].encode("utf-8")) % RANDOM_VERSE_VARIANTS)
+    return random # 'uniform'
+
+def verse_reference_for(user, day=None):
+    preference = user["verse_of_day_preference"]
+    if preference == "random":
+        return str(random_reference(user["bible_id"] or ["kjv"], random_verse_rng(user, day)))
+    # Parsed as one of the user's translations, since Vulgate names and verse numbers aren't valid in the others
+    for translation in user["bible_id"] or ["kjv"]:
+        try:
+            return str(parse_reference(preference, translation.lower()))
+        except InvalidReference as e:
+            error = e
+    # Saved before preferences were validated; don't send it to the API
+    print(f"Invalid verse preference for {user['phone_number']} ({error}); using {DEFAULT_REFERENCE}")
+    return DEFAULT_REFERENCE
+
+def _contains(translation, reference):
+    try:
+        parse_reference(reference, translation.lower())
+        return True
+    except InvalidReference:
+        return False
+
+def translations_for(user, reference):
+    # The user's translations that actually contain the passage (an OT verse
+    # can't come from an NT-only translation, nor Psalm 3:9 from one without
+    # the Vulgate's numbering), falling back to KJV
+    return [t for t in user["bible_id"] if _contains(t, reference)] or ["kjv"]
+
+def send_daily_verse(user, verse=None):
+    # `verse` lets the delivery engine pass in a verse it already resolved for the whole bucket.
+    # Each stage is timed into bible_delivery_stage_duration_seconds. Returns
+    # True when the verse was queued, None when today's delivery to the user
+    # was already queued (a re-run bucket) and False when it failed.
+    spans = Spans(DELIVERY_STAGE_SECONDS, f"send_daily_verse {user['phone_number']} ({user['preferred_method']})")
+    try:
+        return _send_daily_verse(user, verse, spans)
+    finally:
+        if TRACE_DELIVERIES:
+            print(spans.summary())
+
+def _enqueue(user, **payload):
+    return True if enqueue(user["phone_number"], user["preferred_method"], **payload) else None
+
+def _send_daily_verse(user, verse, spans):
+    if verse is None:
+        with spans.stage("resolve"):
+            reference = verse_reference_for(user)
+            verse = get_random_verse(translations_for(user, reference), reference)
+    if not verse.get("reference"):
+        # get_random_verse reports failures as the verse text; never send that,
+        # and leave the idempotency key free for a retry
+        print(f"Not delivering to {user['phone_number']}: {verse['text']}")
+        return False
+    
+    full_message = format_daily_message(verse)
+
+    if user["preferred_method"] in ["sms", "whatsapp_text"]:
+        # Queued in the outbox; OutboxDispatcher does the rate-limited Twilio send
+        with spans.stage("enqueue"):
+            return _enqueue(user, body=full_message)
+    elif user["preferred_method"] == "whatsapp_voice_note":
+        with spans.stage("render_audio"):
+            voice_note_file = generate_voice_note(full_message)
+        if voice_note_file:
+            # Served by the web app's /media route straight from the media cache
+            media_url = f"{PUBLIC_BASE_URL}/media/{os.path.basename(voice_note_file)}"
+            with spans.stage("enqueue"):
+                return _enqueue(user, media_url=media_url)
+        else:
+            print("Failed to generate voice note.")
+            return False
+    elif user["preferred_method"] == "call":
+        # Twilio fetches the call script from /twiml/verse, which renders it on demand
+        params = {"ref": verse.get("query") or verse_reference_for(user), "t": verse.get("translation_id") or "kjv"}
+        with spans.stage("enqueue"):
+            return _enqueue(user, twiml_url=f"{PUBLIC_BASE_URL}/twiml/verse?{urlencode(params)}")
+    else:
+        print(f"User {user['phone_number']} has preferred method {user['preferred_method']}, which is not supported.")
+        return False
+
+def resolve_verses(pairs, executor):
+    # Fetch each distinct (reference, translation) once, concurrently. Pairs
+    # that couldn't be fetched are left out.
+    pairs = list(pairs)
+    resolved = {}
+    for pair, verse in zip(pairs, executor.map(lambda pair: get_random_verse([pair[1]], pair[0]), pairs)):
+        if verse.get("reference"):
+            resolved[pair] = verse
+        else:
+            print(f"Could not resolve {pair[0]} ({pair[1]}): {verse['text']}")
+    return resolved
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def deliver_bucket(delivery_time, users, workers=DELIVERY_WORKERS):
+    # `users` may be any iterable (e.g. database.iter_users); it is consumed in
+    # chunks so memory depends on the chunk size, not the bucket size.
+    started = time.time()
+    verses = {} # Distinct (reference, translation) -> verse
+    rendered = set()
+    # In 'daily' mode the whole bucket draws from a few verses, so they're kept
+    # for every chunk; in 'user' and 'uniform' mode nearly every user has their
+    # own, so only the current chunk's are held (repeats hit the scripture cache)
+    share_verses = RANDOM_VERSE_MODE == "daily"
+    deferred = [] # (user, pair)s whose verse couldn't be fetched, retried once later in the bucket
+    total = sent = already_queued = retried = fetched = 0
+    resolve_seconds = render_seconds = 0.0
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        def deliver(assignments):
+            # Resolves and renders what `assignments` need, then fans out the
+            # sends; returns the ones whose verse couldn't be fetched, unsent
+            nonlocal sent, already_queued, fetched, resolve_seconds, render_seconds
+            stage_started = time.time()
+            if not share_verses:
+                verses.clear()
+                rendered.clear()
+            resolved = resolve_verses({pair for _, pair in assignments if pair not in verses}, executor)
+            verses.update(resolved)
+            fetched += len(resolved)
+            ready = [item for item in assignments if item[1] in verses]
+            # Render each distinct voice note once, in parallel, before fanning out
+            voice_texts = {format_daily_message(verses[pair]) for user, pair in ready
+                           if user["preferred_method"] == "whatsapp_voice_note"} - rendered
+            if voice_texts:
+                render_started = time.time()
+                render_many(voice_texts)
+                rendered.update(voice_texts)
+                render_seconds += time.time() - render_started
+            resolve_seconds += time.time() - stage_started
+
+            for result in executor.map(lambda item: _send(item[0], verses[item[1]]), ready):
+                sent += result is True
+                already_queued += result is None
+            return [item for item in assignments if item[1] not in verses]
+
+        for chunk in _chunks(users, DELIVERY_CHUNK_SIZE):
+            # Pick each user's translation up front so identical pairs collapse into one fetch
+            assignments = []
+            for user in chunk:
+                reference = verse_reference_for(user)
+                translation = random.choice(translations_for(user, reference))
+                assignments.append((user, (reference, translation.lower())))
+            deferred += deliver(assignments)
+            total += len(assignments)
+            if len(deferred) >= DELIVERY_CHUNK_SIZE: # Bounded like a chunk; users still failing count as failed
+                retried += len(deferred)
+                deliver(deferred)
+                deferred = []
+        if deferred:
+            retried += len(deferred)
+            deliver(deferred)
+
+    finished = time.time()
+    report = {
+        "delivery_time": delivery_time,
+        "users": total,
+        "distinct_verses": fetched, # Per chunk, unless shared
+        "sent": sent,
+        "already_queued": already_queued, # Queued by an earlier run of this bucket today
+        "failed": total - sent - already_queued,
+        "retried": retried,
+        "resolve_seconds": round(resolve_seconds, 3),
+        "send_seconds": round(finished - started - resolve_seconds, 3),
+        "total_seconds": round(finished - started, 3),
+        "per_second": round(total / (finished - started), 1) if finished > started else float(total),
+        "finished_at": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(finished)),
+    }
+    BUCKET_STAGE_SECONDS.observe(resolve_seconds - render_seconds, stage="resolve")
+    BUCKET_STAGE_SECONDS.observe(render_seconds, stage="render_audio")
+    BUCKET_STAGE_SECONDS.observe(finished - started - resolve_seconds, stage="send")
+    BUCKET_STAGE_SECONDS.observe(finished - started, stage="total")
+    bucket_reports.append(report)
+    del bucket_reports[:-MAX_REPORTS]
+    print(f"Bucket {delivery_time}: {sent}/{total} delivered, {already_queued} already queued, {fetched} distinct verses, "
+          f"{report['total_seconds']}s ({report['per_second']}/s)")
+    return report
+
+def _send(user, verse):
+    try:
+        return send_daily_verse(user, verse=verse)
+    except Exception as e:
+        print(f"Delivery to {user['phone_number']} failed: {e}")
+        return False
+
+def run_bucket(delivery_time):
+    # Streams the bucket from the database when it fires, so it reflects the latest preferences
+    return deliver_bucket(delivery_time, iter_users(delivery_time=delivery_time))
+
+def due_today(delivery_time, now=None):
+    # Local timestamp of "HH:MM" today, whether or not it has passed
+    now = now or time.time()
+    hour, minute = (int(part) for part in delivery_time.split(":")[:2])
+    today = time.localtime(now)
+    return time.mktime((today.tm_year, today.tm_mon, today.tm_mday, hour, minute, 0, 0, 0, -1))
+
+def next_due(delivery_time, now=None):
+    # Next local timestamp at which "HH:MM" comes round
+    now = now or time.time()
+    hour, minute = (int(part) for part in delivery_time.split(":")[:2])
+    due = due_today(delivery_time, now)
+    if due <= now:
+        tomorrow = time.localtime(now + 86400)
+        due = time.mktime((tomorrow.tm_year, tomorrow.tm_mon, tomorrow.tm_mday, hour, minute, 0, 0, 0, -1))
+    return due
+
+class DeliveryScheduler:
+    # Buckets live in a min-heap of (next due, delivery_time); only the distinct
+    # delivery times are held in memory, never the users. Preference edits are
+    # picked up from the user_changes journal and only schedule the affected
+    # users' new times, so nothing is rescanned and no restart is needed.
+    def __init__(self, run=run_bucket, poll_seconds=1.0):
+        self.run = run
+        self.poll_seconds = poll_seconds
+        self.heap = []
+        self.scheduled = set() # delivery_times with a live heap entry
+        self.journal_position = 0
+        self.last_pruned = 0.0
+
+    def load(self, now=None):
+        # Journal position first, so edits racing with the load are replayed, not lost
+        self.journal_position = get_last_change_id()
+        now = now or time.time()
+        catch_up = 0
+        for delivery_time in get_delivery_times():
+            # A bucket already due today may have been cut short by a crash or
+            # restart, so it runs again right away. The outbox's per-user-and-day
+            # idempotency keys skip whoever already got theirs.
+            due = due_today(delivery_time, now)
+            catch_up += due <= now
+            self._schedule(delivery_time, due if due <= now else None)
+        print(f"Scheduled {len(self.scheduled)} delivery time(s), {catch_up} already due today to catch up")
+
+    def _schedule(self, delivery_time, due=None):
+        if delivery_time not in self.scheduled:
+            heapq.heappush(self.heap, (due or next_due(delivery_time), delivery_time))
+            self.scheduled.add(delivery_time)
+
+    def apply_changes(self):
+        changed, self.journal_position = get_user_changes(self.journal_position)
+        for phone_number in changed:
+            user = get_user_preferences(phone_number)
+            if user:
+                self._schedule(user["delivery_time"])
+            # A user who moved away or was deleted may leave an empty bucket;
+            # run_due drops it when it comes up.
+        return len(changed)
+
+    def run_due(self, now=None):
+        now = now or time.time()
+        while self.heap and self.heap[0][0] <= now:
+            _, delivery_time = heapq.heappop(self.heap)
+            if not has_users_at(delivery_time):
+                self.scheduled.discard(delivery_time) # Everyone left this bucket; drop it lazily
+                continue
+            heapq.heappush(self.heap, (next_due(delivery_time, now), delivery_time))
+            try:
+                self.run(delivery_time)
+            except Exception as e:
+                print(f"Bucket {delivery_time} failed: {e}")
+
+    def run_forever(self):
+        while True:
+            self.apply_changes()
+            self.run_due()
+            if time.time() - self.last_pruned > 3600:
+                prune_user_changes(JOURNAL_RETENTION_SECONDS)
+                self.last_pruned = time.time()
+            wait = self.heap[0][0] - time.time() if self.heap else self.poll_seconds
+            time.sleep(max(0.0, min(wait, self.poll_seconds)))
+
+def run_scheduler():
+    init_db()  # Initialize the database
+    print("Welcome to the Bible App!")
+
+    print("Loading user preferences from database...")
+    scheduler = DeliveryScheduler()
+    scheduler.load()
+    if not scheduler.scheduled:
+        print("No users found in the database. Please add preferences via the web app.")
+
+    # Sends happen on the dispatcher's threads, so a crash mid-bucket leaves the
+    # rest queued in the outbox for the next start instead of losing them
+    dispatcher = OutboxDispatcher()
+    dispatcher.start()
+
+    if METRICS_PORT:
+        register_stats("cache", cache_stats)
+        register_stats("upstream", upstream_stats)
+        register_stats("outbox", lambda: dict(dispatcher.stats, **{f"rows_{status}": n for status, n in get_outbox_counts().items()}))
+        start_http_server(METRICS_PORT)
+
+    print("Scheduler started. Waiting for jobs...")
+    scheduler.run_forever()
+
+if __name__ == "__main__":
+    run_scheduler()
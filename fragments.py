@@ -0,0 +1,60 @@
+import threading
+from collections import OrderedDict
+from flask import render_template
+from markupsafe import Markup
+import http_cache
+from config import FRAGMENT_CACHE_ENTRIES
+
+# Rendered pieces of bible_reader.html that only depend on the translation,
+# book and chapter: the translation/book selectors, the chapter grid and the
+# verse body. Each chapter page then renders just its thin outer template.
+# Keys include the template version, and refresh_template_version() clears
+# everything when a template changes on disk.
+_fragments = OrderedDict() # (template version, name, *key) -> Markup
+_lock = threading.Lock()
+enabled = True # The render benchmark flips this to measure uncached renders
+stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+def render_fragment(name, key, cache=True, **context):
+    # name is a template under templates/fragments/; key must cover everything
+    # in context that changes the output
+    full_key = (http_cache.TEMPLATE_VERSION, name) + tuple(key)
+    if enabled and cache:
+        with _lock:
+            html = _fragments.get(full_key)
+            if html is not None:
+                _fragments.move_to_end(full_key)
+                stats["hits"] += 1
+                return html
+        stats["misses"] += 1
+    html = Markup(render_template(f"fragments/{name}.html", **context))
+    if enabled and cache:
+        with _lock:
+            _fragments[full_key] = html
+            while len(_fragments) > FRAGMENT_CACHE_ENTRIES:
+                _fragments.popitem(last=False)
+                stats["evictions"] += 1
+    return html
+
+def chapter_fragments(translation, book, chapter_data, books_for_nav, total_chapters, translations):
+    return {
+        "translation_options": render_fragment("translation_options", (translation,),
+                                               translations=translations, translation=translation),
+        "book_options": render_fragment("book_options", (translation, book),
+                                        books_for_nav=books_for_nav, book=book),
+        # Error pages have no verses and may succeed on the next request
+        "verses": render_fragment("verses", (translation, book, chapter_data['chapter']), cache=bool(chapter_data['verses']),
+                                  chapter_data=chapter_data),
+        "chapter_grid": render_fragment("chapter_grid", (translation, book, total_chapters),
+                                        translation=translation, book=book, total_chapters=total_chapters),
+    }
+
+def clear_fragments():
+    with _lock:
+        _fragments.clear()
+
+def fragment_stats():
+    with _lock:
+        entries = len(_fragments)
+    lookups = stats["hits"] + stats["misses"]
+    return dict(stats, entries=entries, hit_ratio=round(stats["hits"] / lookups, 4) if lookups else 0.0)
@@ -0,0 +1,147 @@
+import gzip
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from functools import wraps
+from flask import g, request, make_response
+
+try:
+    import brotli # Optional: pip install brotli
+except ImportError:
+    brotli = None
+
+# Conditional GET and precompressed bodies for pages whose content is fully
+# determined by their URL (scripture text never changes). The ETag covers the
+# route's own key plus TEMPLATE_VERSION, so a template edit invalidates everything.
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
+MIN_COMPRESS_BYTES = 512
+MAX_STORED_BODIES = 512 # Hot pages kept as ready-to-send (possibly compressed) bytes
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+def _template_files():
+    for root, dirs, files in os.walk(TEMPLATE_DIR):
+        dirs.sort()
+        for name in sorted(files):
+            yield os.path.join(root, name)
+
+def _template_version():
+    digest = hashlib.sha256()
+    for path in _template_files():
+        digest.update(os.path.relpath(path, TEMPLATE_DIR).encode("utf-8"))
+        with open(path, "rb") as f:
+            digest.update(f.read())
+    return digest.hexdigest()[:16]
+
+def _template_signature():
+    return tuple((path, os.stat(path).st_mtime_ns) for path in _template_files())
+
+TEMPLATE_VERSION = _template_version()
+_signature = _template_signature()
+
+_bodies = OrderedDict() # etag (one per encoding) -> (body bytes, content type, content encoding)
+_bodies_lock = threading.Lock()
+stats = {"not_modified": 0, "stored_hits": 0, "rendered": 0, "compressed_bytes_saved": 0}
+
+def refresh_template_version():
+    # Re-hash the templates if any changed on disk (the dev server reloads them
+    # without a restart). Returns True when the version moved and the stored
+    # bodies were dropped; callers clear their own template-derived caches.
+    global TEMPLATE_VERSION, _signature
+    signature = _template_signature()
+    if signature == _signature:
+        return False
+    _signature = signature
+    version = _template_version()
+    if version == TEMPLATE_VERSION:
+        return False
+    TEMPLATE_VERSION = version
+    with _bodies_lock:
+        _bodies.clear()
+    print(f"Templates changed; cache version is now {version}")
+    return True
+
+def make_etag(*parts):
+    return hashlib.sha256("\0".join([TEMPLATE_VERSION] + [str(p) for p in parts]).encode("utf-8")).hexdigest()[:32]
+
+def skip_http_cache():
+    # Call from a view whose response must not be cached (e.g. an upstream error page)
+    g.skip_http_cache = True
+
+def _negotiate_encoding():
+    if brotli is not None and request.accept_encodings["br"]:
+        return "br"
+    if request.accept_encodings["gzip"]:
+        return "gzip"
+    return None
+
+def _compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    return body # Identity
+
+def _stored(key):
+    with _bodies_lock:
+        entry = _bodies.get(key)
+        if entry is not None:
+            _bodies.move_to_end(key)
+        return entry
+
+def _store(key, entry):
+    with _bodies_lock:
+        _bodies[key] = entry
+        _bodies.move_to_end(key)
+        while len(_bodies) > MAX_STORED_BODIES:
+            _bodies.popitem(last=False)
+
+def _finish(response, etag, cache_control, encoding):
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = cache_control
+    response.vary.add("Accept-Encoding")
+    if encoding:
+        response.headers["Content-Encoding"] = encoding
+    return response
+
+def http_cached(key_func, cache_control):
+    # key_func(**view_kwargs) returns the parts that identify the response body
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            accepted = _negotiate_encoding()
+            # Strong ETags must differ per content-coding, so the negotiated
+            # coding is part of the tag ("<hash>-gzip"; identity has none)
+            etag = make_etag(view.__name__, *key_func(**kwargs))
+            if accepted:
+                etag = f"{etag}-{accepted}"
+            if request.if_none_match.contains(etag):
+                stats["not_modified"] += 1
+                return _finish(make_response("", 304), etag, cache_control, None)
+
+            stored = _stored(etag)
+            if stored is not None:
+                # Hot page: send the stored bytes without rendering or compressing again
+                stats["stored_hits"] += 1
+                data, content_type, encoding = stored
+                return _finish(make_response(data, 200, {"Content-Type": content_type}), etag, cache_control, encoding)
+
+            response = make_response(view(*args, **kwargs))
+            stats["rendered"] += 1
+            if response.status_code != 200 or g.get("skip_http_cache") or response.direct_passthrough:
+                return response
+            body = response.get_data()
+            encoding = accepted if accepted and len(body) >= MIN_COMPRESS_BYTES else None
+            data = _compress(body, encoding)
+            stats["compressed_bytes_saved"] += len(body) - len(data)
+            _store(etag, (data, response.content_type, encoding))
+            response.set_data(data)
+            return _finish(response, etag, cache_control, encoding)
+        return wrapper
+    return decorator
+
+def http_cache_stats():
+    with _bodies_lock:
+        stored = len(_bodies)
+    return dict(stats, stored_bodies=stored, template_version=TEMPLATE_VERSION, brotli=brotli is not None)
@@ -1,27 +1,95 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify
-from database import init_db, add_user, update_user_preferences, get_user_preferences
+import csv
+import hmac
+import io
+import re
+import time
+from functools import wraps
+from flask import Flask, render_template, request, redirect, url_for, flash, session, jsonify, send_from_directory, abort, Response, g
+from flask import stream_template, stream_with_context
+from database import init_db, save_user_preferences
 import os
 from dotenv import load_dotenv
-from utils import get_random_verse, get_chapter_content, get_all_translations, get_books_for_translation, AVAILABLE_TRANSLATIONS # Import new functions and AVAILABLE_TRANSLATIONS
+from cache import cache_stats
+from config import MEDIA_DIR, COMPARE_MAX_TRANSLATIONS, ADMIN_API_TOKEN
+from upstream import upstream_stats
+from search import search
+from prefetch import note_request, schedule_adjacent, prefetch_stats
+from http_cache import http_cached, skip_http_cache, http_cache_stats, refresh_template_version
+from metrics import HTTP_SECONDS, CONTENT_TYPE as METRICS_CONTENT_TYPE, register_stats, render as render_metrics
+from fragments import chapter_fragments, clear_fragments, fragment_stats
+from book_export import FORMATS as EXPORT_FORMATS, LANGUAGES as EXPORT_LANGUAGES, plan_chapters, iter_chapters, render_txt, render_html, render_epub, display_name
+from bulk_users import FORMATS as BULK_FORMATS, READERS as BULK_READERS, import_users, export_users, detect_format
+from utils import get_random_verse, get_chapter_content, get_all_translations, get_books_for_translation, is_known_translation, AVAILABLE_TRANSLATIONS # Import new functions and AVAILABLE_TRANSLATIONS
+from utils import generate_twiml_for_call, format_daily_message, get_parallel_chapters, align_verses
+from references import InvalidReference, parse_reference, chapter_reference, chapter_count, normalize_verse_preference
 
 load_dotenv()
 
 app = Flask(__name__)
 app.secret_key = os.getenv('FLASK_SECRET_KEY', 'supersecret') # Use an environment variable or a default
 
-# Removed as it's deprecated in newer Flask versions
-# def setup():
-#     init_db()
+# Create tables and apply pending migrations at import, since gunicorn never runs __main__
+init_db()
+
+# Scripture pages never change for a given URL; browsers revalidate daily via
+# the ETag, shared caches/CDNs keep them for a week.
+PAGE_CACHE_CONTROL = 'public, max-age=86400, s-maxage=604800, stale-while-revalidate=86400'
+BOOKS_CACHE_CONTROL = 'public, max-age=604800'
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_timing(response):
+    # request.endpoint (the view name) keeps label cardinality bounded, unlike the path
+    HTTP_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=request.endpoint or 'unmatched',
+                         method=request.method, status=response.status_code)
+    g.request_timed = True
+    return response
+
+@app.teardown_request
+def record_failure(error):
+    # after_request doesn't run when a view raises
+    if error is not None and 'request_started' in g and not g.get('request_timed'):
+        HTTP_SECONDS.observe(time.perf_counter() - g.request_started, endpoint=request.endpoint or 'unmatched',
+                             method=request.method, status=500)
+
+for component, stats_func in (('upstream', upstream_stats), ('cache', cache_stats), ('prefetch', prefetch_stats),
+                              ('http_cache', http_cache_stats), ('fragments', fragment_stats)):
+    register_stats(component, stats_func)
+
+@app.before_request
+def check_templates():
+    # Only the auto-reloading dev server can see template edits without a restart
+    if app.debug or app.config['TEMPLATES_AUTO_RELOAD']:
+        if refresh_template_version():
+            clear_fragments()
 
 @app.route('/')
+@http_cached(lambda: (request.args.get('translation', 'KJV'),), PAGE_CACHE_CONTROL)
 def bible_reader():
     translations = get_all_translations()
     books = get_books_for_translation("KJV") # Default to KJV for initial book list
     return render_template('bible_reader.html', translations=translations, books=books)
 
 @app.route('/<string:translation_name>/<string:book_name>/<int:chapter_number>')
+@http_cached(lambda translation_name, book_name, chapter_number: (translation_name, book_name, chapter_number), PAGE_CACHE_CONTROL)
 def view_chapter(translation_name, book_name, chapter_number):
+    # Unknown translations and books, chapters past the end and books outside the translation's canon never reach the API
+    if not is_known_translation(translation_name):
+        abort(404)
+    try:
+        reference = chapter_reference(translation_name, book_name, chapter_number)
+    except InvalidReference:
+        abort(404)
+    if reference.name != book_name:
+        # One URL per chapter (/kjv/jn/3 -> /kjv/John/3), so caches aren't split across spellings
+        return redirect(url_for('view_chapter', translation_name=translation_name, book_name=reference.name,
+                                chapter_number=chapter_number), 301)
     chapter_data = get_chapter_content(translation_name, book_name, chapter_number)
+    if not chapter_data['verses']:
+        skip_http_cache() # Upstream error page; don't let anyone cache it
     
     # Ensure chapter number from chapter_data is an integer for comparison
     if chapter_data and 'chapter' in chapter_data and isinstance(chapter_data['chapter'], str):
@@ -30,27 +98,184 @@ def view_chapter(translation_name, book_name, chapter_number):
         except ValueError:
             chapter_data['chapter'] = 1 # Default to 1 if conversion fails
 
-    # Fetch all books for navigation sidebar/dropdown (assuming same for all translations for simplicity)
+    # Books in this translation's canon for the navigation dropdown
     books_for_nav = get_books_for_translation(translation_name)
-    
-    # Find current book to determine total chapters for next/prev logic
-    current_book_info = next((book for book in books_for_nav if book['name'].lower() == book_name.lower()), None)
-    total_chapters = int(current_book_info['chapters']) if current_book_info and 'chapters' in current_book_info else 100 # Default if not found, ensure int
+    total_chapters = chapter_count(reference.book)
 
+    # The selectors, chapter grid and verse body come pre-rendered from the fragment cache
+    fragments = chapter_fragments(translation_name, book_name, chapter_data, books_for_nav, total_chapters,
+                                  get_all_translations())
     return render_template('bible_reader.html',
                            chapter_data=chapter_data,
                            translation=translation_name,
                            book=book_name,
                            chapter=chapter_number,
-                           books_for_nav=books_for_nav,
                            total_chapters=total_chapters,
+                           fragments=fragments,
                            translations=get_all_translations()) # Pass all translations here as well
 
+@app.after_request
+def prefetch_adjacent(response):
+    # Here rather than in view_chapter, which http_cached skips for stored-body
+    # hits and 304s: those hot chapters are the ones most worth counting and
+    # warming the neighbours of. Unknown or non-canonical URLs got a 404/301.
+    if request.endpoint == 'view_chapter' and response.status_code in (200, 304):
+        args = request.view_args
+        note_request(args['translation_name'], args['book_name'], args['chapter_number'])
+        # Warm the cache with the chapters the reader is likely to click next
+        schedule_adjacent(args['translation_name'], args['book_name'], args['chapter_number'], get_chapter_content)
+    return response
+
+@app.route('/compare/<string:book_name>/<int:chapter_number>')
+def compare_chapter(book_name, chapter_number):
+    # e.g. /compare/John/3?t=kjv,web,bbe (or repeated t= from the form's multi-select)
+    raw = ','.join(request.args.getlist('t')) or 'kjv,web'
+    requested = [t.strip().lower() for t in raw.split(',') if t.strip()]
+    selected = list(dict.fromkeys(requested))[:COMPARE_MAX_TRANSLATIONS]
+    unknown = [t for t in selected if not is_known_translation(t)]
+    if unknown:
+        abort(400, description=f"Unknown translation(s): {', '.join(unknown)}")
+    try:
+        reference = chapter_reference(None, book_name, chapter_number)
+    except InvalidReference:
+        abort(404)
+    book_name = reference.name
+    chapters = get_parallel_chapters(selected, book_name, chapter_number)
+    names = {t['id']: t['name'] for t in AVAILABLE_TRANSLATIONS}
+    columns = [{
+        'id': t,
+        'name': names.get(t, t.upper()),
+        'error': 'Timed out' if data is None else (None if data['verses'] else data['text']),
+    } for t, data in chapters.items()]
+    return render_template('compare.html', book=book_name, chapter=chapter_number, total_chapters=chapter_count(reference.book),
+                           columns=columns, rows=align_verses(chapters), translations=get_all_translations(),
+                           selected=selected)
+
+@app.route('/export/<string:translation_name>/<string:book_name>')
+@app.route('/export/<string:translation_name>', defaults={'book_name': None})
+def export_book(translation_name, book_name):
+    # A whole book (/export/kjv/John?format=epub) or a reading plan
+    # (/export/kjv?plan=Genesis 1-3; Psalm 23&format=txt), streamed chapter by chapter
+    fmt = request.args.get('format', 'txt')
+    if fmt not in EXPORT_FORMATS:
+        abort(400, description=f"format must be one of {', '.join(EXPORT_FORMATS)}")
+    plan_text = book_name or request.args.get('plan', '')
+    # Validated before the first byte goes out; after that a failed chapter can only be noted in the output
+    try:
+        plan = plan_chapters(translation_name, plan_text)
+    except InvalidReference as e:
+        abort(404 if book_name else 400, description=str(e))
+    title = plan[0][0] if book_name else f"Reading plan: {plan_text.strip()}"
+    chapters = iter_chapters(translation_name, plan)
+    if fmt == 'html':
+        body = stream_template('export/book.html', title=title, translation_name=display_name(translation_name),
+                               language=EXPORT_LANGUAGES.get(translation_name.lower(), 'en'), sections=render_html(chapters))
+    elif fmt == 'epub':
+        body = stream_with_context(render_epub(title, translation_name, plan, chapters))
+    else:
+        body = stream_with_context(render_txt(title, translation_name, chapters))
+    filename = re.sub(r'[^A-Za-z0-9]+', '-', title).strip('-').lower()[:80] or 'export'
+    return Response(body, content_type=EXPORT_FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename="{filename}-{translation_name.lower()}.{fmt}"'})
+
 @app.route('/get_books/<string:translation_id>')
+@http_cached(lambda translation_id: (translation_id.upper(),), BOOKS_CACHE_CONTROL)
 def get_books(translation_id):
     books = get_books_for_translation(translation_id)
     return jsonify(books)
 
+MEDIA_NAME = re.compile(r"^[0-9a-f]{64}\.ogg$") # Content-addressed names from audio.py
+MEDIA_MAX_AGE = 365 * 24 * 3600
+
+@app.route('/media/<string:filename>')
+def media(filename):
+    if not MEDIA_NAME.match(filename):
+        abort(404)
+    # send_file handles If-None-Match and Range requests when conditional=True;
+    # the content hash in the name doubles as a strong ETag
+    response = send_from_directory(os.path.abspath(MEDIA_DIR), filename, mimetype='audio/ogg',
+                                   conditional=True, etag=filename[:-4], max_age=MEDIA_MAX_AGE)
+    response.headers['Cache-Control'] = f'public, max-age={MEDIA_MAX_AGE}, immutable' # The name is the content hash
+    return response
+
+@app.route('/twiml/verse', methods=['GET', 'POST'])
+def twiml_verse():
+    # Twilio requests this when a daily-verse call connects (POST by default)
+    translation = request.values.get('t', 'kjv')
+    if not is_known_translation(translation):
+        abort(400)
+    try:
+        reference = str(parse_reference(request.values.get('ref', 'john 3:16'), translation.lower()))
+    except InvalidReference:
+        abort(400)
+    verse = get_random_verse([translation], reference)
+    return Response(generate_twiml_for_call(format_daily_message(verse)), mimetype='text/xml')
+
+@app.route('/search')
+def search_page():
+    query = request.args.get('q', '').strip()
+    translation = request.args.get('t', '')
+    results = search(query, translation or None, request.args.get('page', 1, type=int)) if query else None
+    return render_template('search.html', query=query, translation=translation, results=results,
+                           translations=get_all_translations())
+
+@app.route('/api/search')
+def api_search():
+    query = request.args.get('q', '').strip()
+    return jsonify(search(query, request.args.get('t') or None,
+                          request.args.get('page', 1, type=int), request.args.get('per_page', 20, type=int)))
+
+@app.route('/stats')
+def stats():
+    # Upstream client, cache, prefetch, HTTP cache and fragment counters for monitoring
+    return jsonify(upstream=upstream_stats(), cache=cache_stats(), prefetch=prefetch_stats(), http_cache=http_cache_stats(),
+                   fragments=fragment_stats())
+
+@app.route('/metrics')
+def metrics():
+    # Prometheus scrape endpoint; each gunicorn worker reports its own numbers
+    return Response(render_metrics(), mimetype=None, content_type=METRICS_CONTENT_TYPE)
+
+def admin_required(view):
+    # Bearer-token auth for the /admin API; the routes 404 until ADMIN_API_TOKEN is set
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_API_TOKEN:
+            abort(404)
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not hmac.compare_digest(token.strip().encode('utf-8'), ADMIN_API_TOKEN.encode('utf-8')):
+            return jsonify(error='Missing or invalid bearer token'), 401, {'WWW-Authenticate': 'Bearer'}
+        return view(*args, **kwargs)
+    return wrapper
+
+IMPORT_MIMETYPES = {'text/csv': 'csv', 'application/x-ndjson': 'jsonl', 'application/jsonl': 'jsonl', 'application/json': 'jsonl'}
+
+@app.route('/admin/users/import', methods=['POST'])
+@admin_required
+def admin_import_users():
+    # The CSV/JSONL file is the request body (Content-Type text/csv or
+    # application/x-ndjson) or a multipart 'file' upload, and is read as a
+    # stream: curl -H 'Authorization: Bearer ...' -H 'Content-Type: text/csv' --data-binary @users.csv
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+    fmt = request.args.get('format') or (detect_format(upload.filename or '') if upload else IMPORT_MIMETYPES.get(request.mimetype))
+    if fmt not in BULK_FORMATS:
+        return jsonify(error=f"Send the file as {', '.join(IMPORT_MIMETYPES)} or multipart, or pass ?format=csv|jsonl"), 415
+    stream = io.TextIOWrapper(upload.stream if upload else request.stream, encoding='utf-8-sig', newline='')
+    try:
+        summary = import_users(BULK_READERS[fmt](stream), dry_run=request.args.get('dry_run') in ('1', 'true'))
+    except (UnicodeDecodeError, csv.Error) as e:
+        # Batches before the bad byte are already committed; the upsert makes a corrected re-run safe
+        return jsonify(error=f'Could not read the file: {e}'), 400
+    return jsonify(summary)
+
+@app.route('/admin/users/export')
+@admin_required
+def admin_export_users():
+    fmt = request.args.get('format', 'csv')
+    if fmt not in BULK_FORMATS:
+        abort(400)
+    return Response(export_users(fmt), mimetype='text/csv' if fmt == 'csv' else 'application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename=users.{fmt}'})
 
 @app.route('/preferences', methods=['GET', 'POST'])
 def preferences():
@@ -62,31 +287,28 @@ def preferences():
         # bible_translation now comes as a list from the multi-select
         selected_translations = request.form.getlist('bible_translation')
         bible_translations_str = ",".join(selected_translations) # Convert list to comma-separated string
-        verse_preference = request.form['verse_preference']
-
-        user_exists = get_user_preferences(phone_number)
-        if user_exists:
-            update_user_preferences(
-                phone_number,
-                preferred_method=preferred_method,
-                delivery_time=delivery_time,
-                bible_ids_str=bible_translations_str, # Pass as string
-                verse_of_day_preference=verse_preference
-            )
-            flash('Your preferences have been updated successfully!', 'success')
-        else:
-            add_user(
-                phone_number,
-                preferred_method,
-                delivery_time,
-                bible_translations_str, # Pass as string
-                verse_preference
-            )
+        # Checked against every chosen translation's canon, then stored in canonical form
+        try:
+            verse_preference = normalize_verse_preference(request.form['verse_preference'], selected_translations)
+        except InvalidReference as e:
+            flash(f'Invalid verse preference: {e}', 'error')
+            return redirect(url_for('preferences'))
+
+        # One UPSERT transaction instead of a read followed by an insert/update
+        created = save_user_preferences(
+            phone_number,
+            preferred_method,
+            delivery_time,
+            bible_translations_str, # Pass as string
+            verse_preference
+        )
+        if created:
             flash('Your preferences have been saved successfully!', 'success')
+        else:
+            flash('Your preferences have been updated successfully!', 'success')
         return redirect(url_for('preferences')) # Redirect back to preferences to show flash message
     
     return render_template('index.html', verse_of_the_day=verse_of_the_day, available_translations=AVAILABLE_TRANSLATIONS)
 
 if __name__ == '__main__':
-    init_db() # Initialize the database here instead
     app.run(debug=True)
@@ -0,0 +1,195 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+
+# Minimal Prometheus instrumentation: counters and histograms kept in process
+# memory and rendered in the text exposition format by render(). Each gunicorn
+# worker and the scheduler keep their own numbers, so scrape every process
+# (Prometheus sums them with sum by (...)).
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_metrics = [] # In registration order
+_collectors = [] # Callables returning [(name, type, help, [(labels, value)])]
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.values = {} # label values -> count
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        with self._lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}")
+        return lines
+
+class Histogram:
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self.values = {} # label values -> [per-bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labels)
+        index = bisect_left(self.buckets, value) # First bucket with le >= value
+        with self._lock:
+            series = self.values.get(key)
+            if series is None:
+                series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self.values.items()):
+                cumulative = 0
+                for le, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                    cumulative += count
+                    lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, [('le', _format_value(le))])} {cumulative}")
+                lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(series[-1])}")
+                lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+def timed(histogram, **labels):
+    # Decorator form of histogram.time(); an "op" label defaults to the function name
+    def decorator(func):
+        call_labels = dict(labels)
+        if "op" in histogram.labels:
+            call_labels.setdefault("op", func.__name__)
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with histogram.time(**call_labels):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def register_collector(collect):
+    _collectors.append(collect)
+
+def register_stats(component, stats_func):
+    # Exposes an existing *_stats() dict as gauges (numeric values only), and
+    # its hit ratio, if it has one, as bible_cache_hit_ratio
+    def collect():
+        stats = stats_func()
+        samples = [({"component": component, "stat": key}, int(value) if isinstance(value, bool) else value)
+                   for key, value in sorted(stats.items()) if isinstance(value, (int, float))]
+        families = [("bible_component_stat", "gauge", "Internal counters from the component's stats()", samples)]
+        ratio = stats.get("hit_ratio", stats.get("hit_rate"))
+        if ratio is not None:
+            families.append(("bible_cache_hit_ratio", "gauge", "Fraction of lookups served from cache", [({"cache": component}, ratio)]))
+        return families
+    register_collector(collect)
+
+def render():
+    lines = []
+    for metric in _metrics:
+        lines.extend(metric.render())
+    # Collectors can return the same family (e.g. several caches' hit ratios); group by name
+    families = {}
+    for collect in _collectors:
+        try:
+            for name, kind, help, samples in collect():
+                families.setdefault(name, (kind, help, []))[2].extend(samples)
+        except Exception as e:
+            print(f"Metrics collector failed: {e}")
+    for name, (kind, help, samples) in families.items():
+        lines.extend([f"# HELP {name} {help}", f"# TYPE {name} {kind}"])
+        for labels, value in samples:
+            lines.append(f"{name}{_format_labels(labels.keys(), labels.values())} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+class Spans:
+    # Per-stage timings for one run of something (e.g. one send_daily_verse):
+    # each stage is observed into `histogram` under its "stage" label, and the
+    # whole breakdown can be printed when tracing is on.
+    def __init__(self, histogram, name):
+        self.histogram = histogram
+        self.name = name
+        self.stages = []
+
+    @contextmanager
+    def stage(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.histogram.observe(elapsed, stage=stage)
+            self.stages.append((stage, elapsed))
+
+    def summary(self):
+        return f"{self.name}: " + " ".join(f"{stage}={elapsed * 1000:.1f}ms" for stage, elapsed in self.stages)
+
+def start_http_server(port, host="0.0.0.0"):
+    # For processes without Flask (the scheduler); serves /metrics on a daemon thread
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer # Web workers never need it
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass # Scrapes every few seconds would drown the scheduler's log
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Serving metrics on :{port}/metrics")
+    return server
+
+# --- Shared metrics ---
+HTTP_SECONDS = Histogram("bible_http_request_duration_seconds", "Flask request latency", ["endpoint", "method", "status"])
+UPSTREAM_SECONDS = Histogram("bible_upstream_request_duration_seconds", "bible-api.com request latency per attempt", ["outcome"])
+SQLITE_SECONDS = Histogram("bible_sqlite_query_duration_seconds", "SQLite call latency", ["db", "op"])
+TTS_SECONDS = Histogram("bible_tts_render_duration_seconds", "Voice note synthesis and encoding time")
+TWILIO_SECONDS = Histogram("bible_twilio_send_duration_seconds", "Twilio API call latency", ["channel", "outcome"])
+DELIVERY_STAGE_SECONDS = Histogram("bible_delivery_stage_duration_seconds", "Time per send_daily_verse stage", ["stage"])
+BUCKET_STAGE_SECONDS = Histogram("bible_bucket_stage_duration_seconds", "Time per delivery bucket stage", ["stage"],
+                                 buckets=DEFAULT_BUCKETS + (60.0, 300.0))
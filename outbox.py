@@ -0,0 +1,185 @@
+import json
+import re
+import threading
+import time
+from datetime import date
+from config import (TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, TWILIO_API_URL, TWILIO_PHONE_NUMBER, TWILIO_WHATSAPP_NUMBER,
+                    OUTBOX_WORKERS, OUTBOX_MAX_ATTEMPTS, OUTBOX_RETRY_BASE_SECONDS, OUTBOX_LEASE_SECONDS,
+                    SMS_SEND_RATE, WHATSAPP_SEND_RATE, VOICE_CALL_RATE)
+from metrics import TWILIO_SECONDS, Counter
+from database import init_db, enqueue_delivery, claim_deliveries, renew_delivery_lease, mark_delivery_sent, mark_delivery_failed, get_outbox_counts
+
+CLAIM_BATCH = 20
+MAX_RETRY_SECONDS = 3600
+DELIVERIES = Counter("bible_outbox_deliveries_total", "Outbox rows processed, by result", ["channel", "result"])
+
+class TokenBucket:
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        # Blocks until a token is available
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+def _sender_for(channel):
+    # (sender number, rate-limit class) for a channel
+    if channel in ("whatsapp_text", "whatsapp_voice_note"):
+        return TWILIO_WHATSAPP_NUMBER, "whatsapp"
+    if channel == "call":
+        return TWILIO_PHONE_NUMBER, "voice"
+    return TWILIO_PHONE_NUMBER, "sms"
+
+RATES = {"sms": SMS_SEND_RATE, "whatsapp": WHATSAPP_SEND_RATE, "voice": VOICE_CALL_RATE}
+
+def idempotency_key(phone_number, channel, day=None):
+    # One delivery per user, channel and day
+    return f"{(day or date.today()).isoformat()}:{phone_number}:{channel}"
+
+def enqueue(phone_number, channel, day=None, **payload):
+    return enqueue_delivery(idempotency_key(phone_number, channel, day), phone_number, channel, json.dumps(payload))
+
+def _redirected_http_client(base_url):
+    from twilio.http.http_client import TwilioHttpClient
+
+    class RedirectedHttpClient(TwilioHttpClient):
+        def request(self, method, url, *args, **kwargs):
+            return super().request(method, re.sub(r"^https://[^/]+", base_url, url), *args, **kwargs)
+    return RedirectedHttpClient()
+
+def default_client():
+    from twilio.rest import Client
+    if TWILIO_API_URL:
+        return Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, http_client=_redirected_http_client(TWILIO_API_URL))
+    return Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
+
+def send(client, channel, phone_number, payload):
+    # Returns the Twilio SID; raises on failure
+    if channel == "sms":
+        return client.messages.create(to=phone_number, from_=TWILIO_PHONE_NUMBER, body=payload["body"]).sid
+    if channel == "whatsapp_text":
+        return client.messages.create(to=f"whatsapp:{phone_number}", from_=f"whatsapp:{TWILIO_WHATSAPP_NUMBER}",
+                                      body=payload["body"]).sid
+    if channel == "whatsapp_voice_note":
+        return client.messages.create(to=f"whatsapp:{phone_number}", from_=f"whatsapp:{TWILIO_WHATSAPP_NUMBER}",
+                                      media_url=[payload["media_url"]]).sid
+    if channel == "call":
+        return client.calls.create(to=phone_number, from_=TWILIO_PHONE_NUMBER, url=payload["twiml_url"]).sid
+    raise ValueError(f"Unsupported channel: {channel}")
+
+def _is_permanent(error):
+    # 4xx from Twilio (bad number, unsubscribed, ...) won't succeed on retry; 429 will
+    status = getattr(error, "status", None)
+    return isinstance(error, (ValueError, KeyError)) or (status is not None and 400 <= status < 500 and status != 429)
+
+class OutboxDispatcher:
+    def __init__(self, client=None, workers=OUTBOX_WORKERS, poll_seconds=1.0):
+        self.client = client or default_client()
+        self.workers = workers
+        self.poll_seconds = poll_seconds
+        self.buckets = {}
+        self.stats = {"sent": 0, "retried": 0, "dead": 0, "lost_lease": 0}
+        self._buckets_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._threads = []
+
+    def _bucket(self, channel):
+        key = _sender_for(channel)
+        with self._buckets_lock:
+            if key not in self.buckets:
+                self.buckets[key] = TokenBucket(RATES[key[1]])
+            return self.buckets[key]
+
+    def process(self, row):
+        started = None
+        try:
+            self._bucket(row["channel"]).acquire()
+            # Rows at the back of a claimed batch can wait out their lease behind
+            # the rate limit; renew it, and skip the row if another worker has
+            # already reclaimed it, so it's never sent twice
+            if not renew_delivery_lease(row["id"], row["attempts"], OUTBOX_LEASE_SECONDS):
+                self.stats["lost_lease"] += 1
+                return False
+            started = time.perf_counter() # Rate-limit waits aren't Twilio latency
+            sid = send(self.client, row["channel"], row["phone_number"], json.loads(row["payload"]))
+        except Exception as e:
+            if started is not None:
+                TWILIO_SECONDS.observe(time.perf_counter() - started, channel=row["channel"], outcome="error")
+            if _is_permanent(e) or row["attempts"] >= OUTBOX_MAX_ATTEMPTS:
+                print(f"Giving up on {row['idempotency_key']} after {row['attempts']} attempt(s): {e}")
+                mark_delivery_failed(row["id"], e)
+                self.stats["dead"] += 1
+                DELIVERIES.inc(channel=row["channel"], result="dead")
+            else:
+                delay = min(MAX_RETRY_SECONDS, OUTBOX_RETRY_BASE_SECONDS * (2 ** (row["attempts"] - 1)))
+                mark_delivery_failed(row["id"], e, retry_at=time.time() + delay)
+                self.stats["retried"] += 1
+                DELIVERIES.inc(channel=row["channel"], result="retried")
+            return False
+        TWILIO_SECONDS.observe(time.perf_counter() - started, channel=row["channel"], outcome="ok")
+        mark_delivery_sent(row["id"], sid)
+        self.stats["sent"] += 1
+        DELIVERIES.inc(channel=row["channel"], result="sent")
+        return True
+
+    def run_once(self):
+        # Claim and process one batch; returns how many rows were claimed
+        rows = claim_deliveries(CLAIM_BATCH, OUTBOX_LEASE_SECONDS)
+        for row in rows:
+            self.process(row)
+        return len(rows)
+
+    def drain(self):
+        # Process until nothing is due (retries scheduled for later are left queued)
+        total = 0
+        while True:
+            claimed = self.run_once()
+            if not claimed:
+                return total
+            total += claimed
+
+    def _worker(self):
+        while not self._stop.is_set():
+            try:
+                if not self.run_once():
+                    self._stop.wait(self.poll_seconds)
+            except Exception as e:
+                print(f"Outbox worker error: {e}")
+                self._stop.wait(self.poll_seconds)
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"outbox-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+
+if __name__ == "__main__":
+    init_db()
+    print(f"Outbox: {get_outbox_counts()}")
+    dispatcher = OutboxDispatcher()
+    dispatcher.start()
+    print(f"Draining outbox with {dispatcher.workers} worker(s)...")
+    try:
+        while True:
+            time.sleep(60)
+            print(f"Outbox: {get_outbox_counts()} | this process: {dispatcher.stats}")
+    except KeyboardInterrupt:
+        dispatcher.stop()
@@ -0,0 +1,108 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from config import PREFETCH_ENABLED, PREFETCH_WORKERS, PREFETCH_MAX_PENDING, PREFETCH_WINDOW_SECONDS
+from cache import make_key, cache_has_fresh
+from corpus import ingested_translations
+from references import BOOKS, book_index, chapter_count, in_canon
+
+# Reading is mostly sequential, so after serving a chapter we warm the cache
+# with its neighbours in the background. The next click is then a cache hit.
+_executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="prefetch")
+_lock = threading.Lock()
+_in_flight = set() # keys currently queued or being fetched
+_prefetched = {} # key -> time it was warmed, until a reader asks for it
+MAX_TRACKED = 5000
+
+stats = {
+    "scheduled": 0,
+    "deduplicated": 0, # already queued or in flight
+    "already_cached": 0,
+    "dropped": 0, # queue full
+    "completed": 0,
+    "failed": 0,
+    "used": 0, # a reader asked for a chapter we prefetched
+    "wasted": 0, # prefetched but not asked for within PREFETCH_WINDOW_SECONDS
+}
+
+def adjacent_chapters(translation, book_name, chapter_number):
+    # (book, chapter) pairs worth warming: next, previous, and the next book's
+    # first chapter when this is the last chapter of a book in the translation's canon
+    book = book_index(book_name, translation)
+    if book is None:
+        return []
+    targets = []
+    if chapter_number < chapter_count(book):
+        targets.append((BOOKS[book][0], chapter_number + 1))
+    elif in_canon(translation, book + 1):
+        targets.append((BOOKS[book + 1][0], 1))
+    if chapter_number > 1:
+        targets.append((BOOKS[book][0], chapter_number - 1))
+    return targets
+
+def _sweep(now):
+    # Called with _lock held: anything unclaimed past the window was wasted
+    expired = [key for key, warmed_at in _prefetched.items() if now - warmed_at > PREFETCH_WINDOW_SECONDS]
+    while len(_prefetched) - len(expired) > MAX_TRACKED:
+        expired.append(next(key for key in _prefetched if key not in expired))
+    for key in expired:
+        del _prefetched[key]
+    stats["wasted"] += len(expired)
+
+def _run(key, fetch):
+    try:
+        data = fetch()
+        ok = bool(data and data.get("verses"))
+    except Exception as e:
+        print(f"Prefetch of {key} failed: {e}")
+        ok = False
+    with _lock:
+        _in_flight.discard(key)
+        if ok:
+            _prefetched[key] = time.time()
+            stats["completed"] += 1
+        else:
+            stats["failed"] += 1
+
+def note_request(translation, book_name, chapter_number):
+    # Call before serving a chapter, to count prefetches that paid off
+    key = make_key("chapter", translation, book_name, chapter_number)
+    with _lock:
+        if _prefetched.pop(key, None) is not None:
+            stats["used"] += 1
+
+def schedule_adjacent(translation, book_name, chapter_number, fetch_chapter):
+    # fetch_chapter(translation, book, chapter) should populate the cache
+    # (utils.get_chapter_content); it runs on the prefetch pool.
+    if not PREFETCH_ENABLED or translation.lower() in ingested_translations():
+        return 0 # Local corpus reads are already instant
+    scheduled = 0
+    now = time.time()
+    for book, chapter in adjacent_chapters(translation, book_name, chapter_number):
+        key = make_key("chapter", translation, book, chapter)
+        with _lock:
+            _sweep(now)
+            if key in _in_flight or key in _prefetched:
+                stats["deduplicated"] += 1
+                continue
+            if len(_in_flight) >= PREFETCH_MAX_PENDING:
+                stats["dropped"] += 1
+                continue
+            _in_flight.add(key)
+        if cache_has_fresh(key):
+            with _lock:
+                _in_flight.discard(key)
+                stats["already_cached"] += 1
+            continue
+        with _lock:
+            stats["scheduled"] += 1
+        _executor.submit(_run, key, lambda b=book, c=chapter: fetch_chapter(translation, b, c))
+        scheduled += 1
+    return scheduled
+
+def prefetch_stats():
+    with _lock:
+        _sweep(time.time())
+        resolved = stats["used"] + stats["wasted"]
+        return dict(stats, pending=len(_in_flight), unclaimed=len(_prefetched),
+                    hit_rate=round(stats["used"] / resolved, 4) if resolved else 0.0)
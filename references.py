@@ -0,0 +1,327 @@
+import random
+import re
+from array import array
+from bisect import bisect_right
+from collections import namedtuple
+from functools import lru_cache
+
+# Canonical book table: (display name, OSIS code, USFM code, chapters) in
+# Protestant canon order. The position in this list is the book's id
+# everywhere else (corpus rows, search index); the USFM code is its stable
+# external id.
+BOOKS = [
+    ("Genesis", "Gen", "GEN", 50), ("Exodus", "Exod", "EXO", 40), ("Leviticus", "Lev", "LEV", 27),
+    ("Numbers", "Num", "NUM", 36), ("Deuteronomy", "Deut", "DEU", 34), ("Joshua", "Josh", "JOS", 24),
+    ("Judges", "Judg", "JDG", 21), ("Ruth", "Ruth", "RUT", 4), ("1 Samuel", "1Sam", "1SA", 31),
+    ("2 Samuel", "2Sam", "2SA", 24), ("1 Kings", "1Kgs", "1KI", 22), ("2 Kings", "2Kgs", "2KI", 25),
+    ("1 Chronicles", "1Chr", "1CH", 29), ("2 Chronicles", "2Chr", "2CH", 36), ("Ezra", "Ezra", "EZR", 10),
+    ("Nehemiah", "Neh", "NEH", 13), ("Esther", "Esth", "EST", 10), ("Job", "Job", "JOB", 42),
+    ("Psalms", "Ps", "PSA", 150), ("Proverbs", "Prov", "PRO", 31), ("Ecclesiastes", "Eccl", "ECC", 12),
+    ("Song of Solomon", "Song", "SNG", 8), ("Isaiah", "Isa", "ISA", 66), ("Jeremiah", "Jer", "JER", 52),
+    ("Lamentations", "Lam", "LAM", 5), ("Ezekiel", "Ezek", "EZK", 48), ("Daniel", "Dan", "DAN", 12),
+    ("Hosea", "Hos", "HOS", 14), ("Joel", "Joel", "JOL", 3), ("Amos", "Amos", "AMO", 9),
+    ("Obadiah", "Obad", "OBA", 1), ("Jonah", "Jonah", "JON", 4), ("Micah", "Mic", "MIC", 7),
+    ("Nahum", "Nah", "NAM", 3), ("Habakkuk", "Hab", "HAB", 3), ("Zephaniah", "Zeph", "ZEP", 3),
+    ("Haggai", "Hag", "HAG", 2), ("Zechariah", "Zech", "ZEC", 14), ("Malachi", "Mal", "MAL", 4),
+    ("Matthew", "Matt", "MAT", 28), ("Mark", "Mark", "MRK", 16), ("Luke", "Luke", "LUK", 24),
+    ("John", "John", "JHN", 21), ("Acts", "Acts", "ACT", 28), ("Romans", "Rom", "ROM", 16),
+    ("1 Corinthians", "1Cor", "1CO", 16), ("2 Corinthians", "2Cor", "2CO", 13), ("Galatians", "Gal", "GAL", 6),
+    ("Ephesians", "Eph", "EPH", 6), ("Philippians", "Phil", "PHP", 4), ("Colossians", "Col", "COL", 4),
+    ("1 Thessalonians", "1Thess", "1TH", 5), ("2 Thessalonians", "2Thess", "2TH", 3), ("1 Timothy", "1Tim", "1TI", 6),
+    ("2 Timothy", "2Tim", "2TI", 4), ("Titus", "Titus", "TIT", 3), ("Philemon", "Phlm", "PHM", 1),
+    ("Hebrews", "Heb", "HEB", 13), ("James", "Jas", "JAS", 5), ("1 Peter", "1Pet", "1PE", 5),
+    ("2 Peter", "2Pet", "2PE", 3), ("1 John", "1John", "1JN", 5), ("2 John", "2John", "2JN", 1),
+    ("3 John", "3John", "3JN", 1), ("Jude", "Jude", "JUD", 1), ("Revelation", "Rev", "REV", 22),
+]
+BOOK_CODES = [(name, osis, usfm) for name, osis, usfm, _ in BOOKS] # Used by the corpus parsers
+
+# Verses per chapter (KJV versification, 31,102 verses), parallel to BOOKS.
+# Other translations on bible-api.com follow it closely enough for random
+# picks, but not for validation (see VERSE_COUNT_TABLES).
+VERSE_COUNTS = [
+    [31, 25, 24, 26, 32, 22, 24, 22, 29, 32, 32, 20, 18, 24, 21, 16, 27, 33, 38, 18, 34, 24, 20, 67, 34, 35, 46, 22, 35, 43, 55, 32, 20, 31, 29, 43, 36, 30, 23, 23, 57, 38, 34, 34, 28, 34, 31, 22, 33, 26],
+    [22, 25, 22, 31, 23, 30, 25, 32, 35, 29, 10, 51, 22, 31, 27, 36, 16, 27, 25, 26, 36, 31, 33, 18, 40, 37, 21, 43, 46, 38, 18, 35, 23, 35, 35, 38, 29, 31, 43, 38],
+    [17, 16, 17, 35, 19, 30, 38, 36, 24, 20, 47, 8, 59, 57, 33, 34, 16, 30, 37, 27, 24, 33, 44, 23, 55, 46, 34],
+    [54, 34, 51, 49, 31, 27, 89, 26, 23, 36, 35, 16, 33, 45, 41, 50, 13, 32, 22, 29, 35, 41, 30, 25, 18, 65, 23, 31, 40, 16, 54, 42, 56, 29, 34, 13],
+    [46, 37, 29, 49, 33, 25, 26, 20, 29, 22, 32, 32, 18, 29, 23, 22, 20, 22, 21, 20, 23, 30, 25, 22, 19, 19, 26, 68, 29, 20, 30, 52, 29, 12],
+    [18, 24, 17, 24, 15, 27, 26, 35, 27, 43, 23, 24, 33, 15, 63, 10, 18, 28, 51, 9, 45, 34, 16, 33],
+    [36, 23, 31, 24, 31, 40, 25, 35, 57, 18, 40, 15, 25, 20, 20, 31, 13, 31, 30, 48, 25],
+    [22, 23, 18, 22],
+    [28, 36, 21, 22, 12, 21, 17, 22, 27, 27, 15, 25, 23, 52, 35, 23, 58, 30, 24, 42, 15, 23, 29, 22, 44, 25, 12, 25, 11, 31, 13],
+    [27, 32, 39, 12, 25, 23, 29, 18, 13, 19, 27, 31, 39, 33, 37, 23, 29, 33, 43, 26, 22, 51, 39, 25],
+    [53, 46, 28, 34, 18, 38, 51, 66, 28, 29, 43, 33, 34, 31, 34, 34, 24, 46, 21, 43, 29, 53],
+    [18, 25, 27, 44, 27, 33, 20, 29, 37, 36, 21, 21, 25, 29, 38, 20, 41, 37, 37, 21, 26, 20, 37, 20, 30],
+    [54, 55, 24, 43, 26, 81, 40, 40, 44, 14, 47, 40, 14, 17, 29, 43, 27, 17, 19, 8, 30, 19, 32, 31, 31, 32, 34, 21, 30],
+    [17, 18, 17, 22, 14, 42, 22, 18, 31, 19, 23, 16, 22, 15, 19, 14, 19, 34, 11, 37, 20, 12, 21, 27, 28, 23, 9, 27, 36, 27, 21, 33, 25, 33, 27, 23],
+    [11, 70, 13, 24, 17, 22, 28, 36, 15, 44],
+    [11, 20, 32, 23, 19, 19, 73, 18, 38, 39, 36, 47, 31],
+    [22, 23, 15, 17, 14, 14, 10, 17, 32, 3],
+    [22, 13, 26, 21, 27, 30, 21, 22, 35, 22, 20, 25, 28, 22, 35, 22, 16, 21, 29, 29, 34, 30, 17, 25, 6, 14, 23, 28, 25, 31, 40, 22, 33, 37, 16, 33, 24, 41, 30, 24, 34, 17],
+    [6, 12, 8, 8, 12, 10, 17, 9, 20, 18, 7, 8, 6, 7, 5, 11, 15, 50, 14, 9, 13, 31, 6, 10, 22, 12, 14, 9, 11, 12, 24, 11, 22, 22, 28, 12, 40, 22, 13, 17, 13, 11, 5, 26, 17, 11, 9, 14, 20, 23, 19, 9, 6, 7, 23, 13, 11, 11, 17, 12, 8, 12, 11, 10, 13, 20, 7, 35, 36, 5, 24, 20, 28, 23, 10, 12, 20, 72, 13, 19, 16, 8, 18, 12, 13, 17, 7, 18, 52, 17, 16, 15, 5, 23, 11, 13, 12, 9, 9, 5, 8, 28, 22, 35, 45, 48, 43, 13, 31, 7, 10, 10, 9, 8, 18, 19, 2, 29, 176, 7, 8, 9, 4, 8, 5, 6, 5, 6, 8, 8, 3, 18, 3, 3, 21, 26, 9, 8, 24, 13, 10, 7, 12, 15, 21, 10, 20, 14, 9, 6],
+    [33, 22, 35, 27, 23, 35, 27, 36, 18, 32, 31, 28, 25, 35, 33, 33, 28, 24, 29, 30, 31, 29, 35, 34, 28, 28, 27, 28, 27, 33, 31],
+    [18, 26, 22, 16, 20, 12, 29, 17, 18, 20, 10, 14],
+    [17, 17, 11, 16, 16, 13, 13, 14],
+    [31, 22, 26, 6, 30, 13, 25, 22, 21, 34, 16, 6, 22, 32, 9, 14, 14, 7, 25, 6, 17, 25, 18, 23, 12, 21, 13, 29, 24, 33, 9, 20, 24, 17, 10, 22, 38, 22, 8, 31, 29, 25, 28, 28, 25, 13, 15, 22, 26, 11, 23, 15, 12, 17, 13, 12, 21, 14, 21, 22, 11, 12, 19, 12, 25, 24],
+    [19, 37, 25, 31, 31, 30, 34, 22, 26, 25, 23, 17, 27, 22, 21, 21, 27, 23, 15, 18, 14, 30, 40, 10, 38, 24, 22, 17, 32, 24, 40, 44, 26, 22, 19, 32, 21, 28, 18, 16, 18, 22, 13, 30, 5, 28, 7, 47, 39, 46, 64, 34],
+    [22, 22, 66, 22, 22],
+    [28, 10, 27, 17, 17, 14, 27, 18, 11, 22, 25, 28, 23, 23, 8, 63, 24, 32, 14, 49, 32, 31, 49, 27, 17, 21, 36, 26, 21, 26, 18, 32, 33, 31, 15, 38, 28, 23, 29, 49, 26, 20, 27, 31, 25, 24, 23, 35],
+    [21, 49, 30, 37, 31, 28, 28, 27, 27, 21, 45, 13],
+    [11, 23, 5, 19, 15, 11, 16, 14, 17, 15, 12, 14, 16, 9],
+    [20, 32, 21],
+    [15, 16, 15, 13, 27, 14, 17, 14, 15],
+    [21],
+    [17, 10, 10, 11],
+    [16, 13, 12, 13, 15, 16, 20],
+    [15, 13, 19],
+    [17, 20, 19],
+    [18, 15, 20],
+    [15, 23],
+    [21, 13, 10, 14, 11, 15, 14, 23, 17, 12, 17, 14, 9, 21],
+    [14, 17, 18, 6],
+    [25, 23, 17, 25, 48, 34, 29, 34, 38, 42, 30, 50, 58, 36, 39, 28, 27, 35, 30, 34, 46, 46, 39, 51, 46, 75, 66, 20],
+    [45, 28, 35, 41, 43, 56, 37, 38, 50, 52, 33, 44, 37, 72, 47, 20],
+    [80, 52, 38, 44, 39, 49, 50, 56, 62, 42, 54, 59, 35, 35, 32, 31, 37, 43, 48, 47, 38, 71, 56, 53],
+    [51, 25, 36, 54, 47, 71, 53, 59, 41, 42, 57, 50, 38, 31, 27, 33, 26, 40, 42, 31, 25],
+    [26, 47, 26, 37, 42, 15, 60, 40, 43, 48, 30, 25, 52, 28, 41, 40, 34, 28, 41, 38, 40, 30, 35, 27, 27, 32, 44, 31],
+    [32, 29, 31, 25, 21, 23, 25, 39, 33, 21, 36, 21, 14, 23, 33, 27],
+    [31, 16, 23, 21, 13, 20, 40, 13, 27, 33, 34, 31, 13, 40, 58, 24],
+    [24, 17, 18, 18, 21, 18, 16, 24, 15, 18, 33, 21, 14],
+    [24, 21, 29, 31, 26, 18],
+    [23, 22, 21, 32, 33, 24],
+    [30, 30, 21, 23],
+    [29, 23, 25, 18],
+    [10, 20, 13, 18, 28],
+    [12, 17, 18],
+    [20, 15, 16, 16, 25, 21],
+    [18, 26, 17, 22],
+    [16, 15, 15],
+    [25],
+    [14, 18, 19, 16, 14, 20, 28, 13, 28, 39, 40, 29, 25],
+    [27, 26, 18, 17, 20],
+    [25, 25, 22, 19, 14],
+    [21, 22, 18],
+    [10, 29, 24, 21, 21],
+    [13],
+    [14],
+    [25],
+    [20, 29, 22, 11, 14, 17, 17, 13, 21, 11, 19, 17, 18, 20, 8, 21, 18, 24, 21, 15, 27, 21],
+]
+
+OLD_TESTAMENT = range(0, 39)
+NEW_TESTAMENT = range(39, 66)
+
+# Common abbreviations, keyed by the book name without its leading number
+# ("Samuel" covers "1 Sam", "2 Sm", ...). Spaces and dots are ignored.
+ABBREVIATIONS = {
+    "Genesis": ["gen", "ge", "gn"], "Exodus": ["exod", "exo", "ex"], "Leviticus": ["lev", "le", "lv"],
+    "Numbers": ["num", "nu", "nm", "nb"], "Deuteronomy": ["deut", "de", "dt"], "Joshua": ["josh", "jos", "jsh"],
+    "Judges": ["judg", "jdg", "jg", "jdgs"], "Ruth": ["rth", "ru"], "Samuel": ["sam", "sa", "sm"],
+    "Kings": ["kgs", "ki", "kin"], "Chronicles": ["chr", "chron", "ch"], "Ezra": ["ezr"],
+    "Nehemiah": ["neh", "ne"], "Esther": ["esth", "est", "es"], "Job": ["jb"],
+    "Psalms": ["ps", "psa", "psm", "pss", "psalm"], "Proverbs": ["prov", "pro", "prv", "pr"],
+    "Ecclesiastes": ["eccl", "eccles", "ecc", "ec", "qoh"],
+    "Song of Solomon": ["song", "sng", "sos", "so", "song of songs", "canticles", "cant"],
+    "Isaiah": ["isa", "is"], "Jeremiah": ["jer", "je", "jr"], "Lamentations": ["lam", "la"],
+    "Ezekiel": ["ezek", "eze", "ezk"], "Daniel": ["dan", "da", "dn"], "Hosea": ["hos", "ho"],
+    "Joel": ["jl"], "Amos": ["am"], "Obadiah": ["obad", "ob"], "Jonah": ["jon", "jnh"],
+    "Micah": ["mic", "mc"], "Nahum": ["nah", "na"], "Habakkuk": ["hab", "hb"],
+    "Zephaniah": ["zeph", "zep", "zp"], "Haggai": ["hag", "hg"], "Zechariah": ["zech", "zec", "zc"],
+    "Malachi": ["mal", "ml"], "Matthew": ["matt", "mat", "mt"], "Mark": ["mrk", "mar", "mk", "mr"],
+    "Luke": ["luk", "lk"], "John": ["jhn", "jn", "joh"], "Acts": ["act", "ac"], "Romans": ["rom", "ro", "rm"],
+    "Corinthians": ["cor", "co"], "Galatians": ["gal", "ga"], "Ephesians": ["eph", "ephes"],
+    "Philippians": ["phil", "php", "pp"], "Colossians": ["col"], "Thessalonians": ["thess", "thes", "th"],
+    "Timothy": ["tim", "ti"], "Titus": ["tit"], "Philemon": ["phlm", "philem", "phm", "pm"],
+    "Hebrews": ["heb"], "James": ["jas", "jm"], "Peter": ["pet", "pe", "pt"],
+    "Jude": ["jud", "jd"], "Revelation": ["rev", "re", "revelations", "apocalypse"],
+}
+_ORDINALS = {"1": ["1", "i", "first", "1st"], "2": ["2", "ii", "second", "2nd"], "3": ["3", "iii", "third", "3rd"]}
+
+# Names used by the Vulgate tradition (Clementine, Douay-Rheims). Samuel/Kings
+# are "1-4 Kings" there, but "1 Kings"/"2 Kings" keep their usual meaning
+# because the reader's navigation and bible-api.com both use the English names.
+VULGATE_NAMES = {
+    "1 Regum": "1 Samuel", "2 Regum": "2 Samuel", "3 Regum": "1 Kings", "4 Regum": "2 Kings",
+    "3 Kings": "1 Kings", "4 Kings": "2 Kings", "1 Paralipomenon": "1 Chronicles", "2 Paralipomenon": "2 Chronicles",
+    "1 Esdras": "Ezra", "2 Esdras": "Nehemiah", "Josue": "Joshua", "Canticle of Canticles": "Song of Solomon",
+    "Canticum Canticorum": "Song of Solomon", "Isaias": "Isaiah", "Jeremias": "Jeremiah", "Ezechiel": "Ezekiel",
+    "Osee": "Hosea", "Abdias": "Obadiah", "Jonas": "Jonah", "Micheas": "Micah", "Habacuc": "Habakkuk",
+    "Sophonias": "Zephaniah", "Aggeus": "Haggai", "Zacharias": "Zechariah", "Malachias": "Malachi",
+    "Apocalypsis": "Revelation",
+}
+
+# Per-translation canon: which books bible-api.com has for it and which naming
+# tradition applies. Translations not listed have all 66 books. The deutero-
+# canonical books of the Vulgate aren't in BOOKS, so its ordering of the
+# remaining books is the same as ours.
+CANONS = {
+    "ylt": {"books": NEW_TESTAMENT, "tradition": "protestant"},
+    "cherokee": {"books": NEW_TESTAMENT, "tradition": "protestant"},
+    "clementine": {"books": range(len(BOOKS)), "tradition": "vulgate"},
+    "dra": {"books": range(len(BOOKS)), "tradition": "vulgate"},
+}
+DEFAULT_CANON = {"books": range(len(BOOKS)), "tradition": "protestant"}
+
+# Translations whose verse numbering is known, so references past the end of a
+# chapter can be rejected. Others differ from KJV in places (WEB has 3 John
+# 1:15 and Revelation 12:18, BKR and the Vulgate number Psalm titles as
+# verses), so only their books and chapters are checked. A reference parsed
+# without a translation is KJV-numbered.
+VERSE_COUNT_TABLES = {"kjv": VERSE_COUNTS}
+
+class InvalidReference(ValueError):
+    pass
+
+def _normalize(name):
+    # "1 Jn." / "1JN" / "1 john" -> "1jn" / "1jn" / "1john"
+    return re.sub(r"[\s.]+", "", str(name)).lower()
+
+def _split_number(name):
+    match = re.match(r"^([123]) (.+)$", name)
+    return (match.group(1), match.group(2)) if match else (None, name)
+
+def _build_index():
+    index = {}
+    for i, (name, osis, usfm, _) in enumerate(BOOKS):
+        number, base = _split_number(name)
+        for alias in [base] + ABBREVIATIONS.get(base, []):
+            for prefix in _ORDINALS[number] if number else [""]:
+                index.setdefault(_normalize(prefix + alias), i)
+        for code in (osis, usfm):
+            index[_normalize(code)] = i # Exact codes win over generated abbreviations
+    return index
+
+# Every spelling (lowercased, no spaces or dots) -> book id, built once so a
+# lookup is a single dict access
+_BOOK_INDEX = _build_index()
+_VULGATE_INDEX = dict(_BOOK_INDEX, **{_normalize(alias): _BOOK_INDEX[_normalize(name)] for alias, name in VULGATE_NAMES.items()})
+
+def canon_for(translation):
+    return CANONS.get(str(translation).lower(), DEFAULT_CANON)
+
+def book_index(book_name, translation=None):
+    # Book id for any name, abbreviation or OSIS/USFM code, or None
+    index = _VULGATE_INDEX if translation and canon_for(translation)["tradition"] == "vulgate" else _BOOK_INDEX
+    return index.get(_normalize(book_name))
+
+def book_name(book):
+    return BOOKS[book][0]
+
+def chapter_count(book):
+    return BOOKS[book][3]
+
+def verse_count(book, chapter):
+    return VERSE_COUNTS[book][chapter - 1]
+
+def in_canon(translation, book):
+    return book in canon_for(translation)["books"]
+
+@lru_cache(maxsize=None)
+def _books_for(translation):
+    return [{"name": BOOKS[i][0], "chapters": BOOKS[i][3]} for i in canon_for(translation)["books"]]
+
+def books_for(translation):
+    # Navigation list ({"name", "chapters"}) for a translation's canon
+    return _books_for(str(translation).lower())
+
+class Reference(namedtuple("Reference", "book chapter verse end_verse")):
+    # book is an index into BOOKS; verse/end_verse are None for a whole chapter
+    @property
+    def name(self):
+        return BOOKS[self.book][0]
+
+    @property
+    def usfm(self):
+        return BOOKS[self.book][2]
+
+    def __str__(self):
+        # Canonical spelling, also what bible-api.com is queried with
+        if self.verse is None:
+            return f"{self.name} {self.chapter}"
+        if self.end_verse is None or self.end_verse == self.verse:
+            return f"{self.name} {self.chapter}:{self.verse}"
+        return f"{self.name} {self.chapter}:{self.verse}-{self.end_verse}"
+
+_REFERENCE = re.compile(r"^\s*(?P<book>.+?)\s*(?P<chapter>\d+)(?:\s*[:.]\s*(?P<verse>\d+)(?:\s*[-–—]\s*(?P<end>\d+))?)?\s*$")
+
+def _check(book, chapter, verse, end_verse, translation):
+    if translation and not in_canon(translation, book):
+        raise InvalidReference(f"{BOOKS[book][0]} is not in the {str(translation).upper()} translation")
+    if not 1 <= chapter <= BOOKS[book][3]:
+        raise InvalidReference(f"{BOOKS[book][0]} has {BOOKS[book][3]} chapter(s), not {chapter}")
+    if verse is not None and verse < 1:
+        raise InvalidReference("Verse numbers start at 1")
+    if end_verse is not None and end_verse < verse:
+        raise InvalidReference(f"Verse range {verse}-{end_verse} runs backwards")
+    counts = VERSE_COUNT_TABLES.get(str(translation or "kjv").lower())
+    if verse is not None and counts is not None:
+        count = counts[book][chapter - 1]
+        if max(verse, end_verse or verse) > count:
+            raise InvalidReference(f"{BOOKS[book][0]} {chapter} has {count} verses")
+    return Reference(book, chapter, verse, end_verse if end_verse != verse else None)
+
+@lru_cache(maxsize=4096)
+def parse_reference(text, translation=None):
+    # "Jn 3:16-18", "1 john 4.8", "Psalm 23", "Jude 3" -> Reference; raises
+    # InvalidReference for anything that doesn't name a real passage
+    match = _REFERENCE.match(str(text))
+    if not match:
+        raise InvalidReference(f"Not a Bible reference: {text!r}")
+    book = book_index(match.group("book"), translation)
+    if book is None:
+        raise InvalidReference(f"Unknown book: {match.group('book')!r}")
+    chapter = int(match.group("chapter"))
+    verse = int(match.group("verse")) if match.group("verse") else None
+    end_verse = int(match.group("end")) if match.group("end") else None
+    if verse is None and BOOKS[book][3] == 1 and chapter > 1:
+        chapter, verse = 1, chapter # Single-chapter books are cited by verse alone
+    return _check(book, chapter, verse, end_verse, translation)
+
+def chapter_reference(translation, book_name, chapter_number):
+    # Validate a reader URL's book/chapter; raises InvalidReference
+    book = book_index(book_name, translation)
+    if book is None:
+        raise InvalidReference(f"Unknown book: {book_name!r}")
+    return _check(book, int(chapter_number), None, None, translation)
+
+def normalize_reference(text, translation=None):
+    return str(parse_reference(text, translation))
+
+def normalize_verse_preference(preference, translations=()):
+    # A daily-verse preference is "random" or a reference that every chosen
+    # translation contains; returned in canonical form
+    preference = preference.strip()
+    if preference.lower() == "random":
+        return "random"
+    references = [parse_reference(preference, translation.lower()) for translation in translations or ["kjv"]]
+    # Spelled and numbered as the first translation parsed it ("4 Regum 2:1"
+    # is only a book name in the Vulgate, and its verse numbers can run past KJV's)
+    return str(references[0])
+
+@lru_cache(maxsize=None)
+def _verse_table(books):
+    # One entry per chapter of the given books: chapters[i] packs book << 8 | chapter
+    # and starts[i] counts the verses before it (starts[-1] is the total). About
+    # 7KB for the whole Bible.
+    chapters = array("H")
+    starts = array("I", [0])
+    for book in books:
+        for chapter, count in enumerate(VERSE_COUNTS[book], 1):
+            chapters.append(book << 8 | chapter)
+            starts.append(starts[-1] + count)
+    return chapters, starts
+
+def random_reference(translations=("kjv",), rng=random):
+    # A uniformly random verse from the translations' combined canon: one
+    # bisect over the cumulative counts and no network
+    books = set()
+    for translation in translations:
+        books.update(canon_for(translation)["books"])
+    chapters, starts = _verse_table(tuple(sorted(books)))
+    n = rng.randrange(starts[-1])
+    i = bisect_right(starts, n) - 1
+    return Reference(chapters[i] >> 8, chapters[i] & 0xFF, n - starts[i] + 1, None)
+
+def seeded_rng(*parts):
+    # Same parts give the same picks in every process (str seeds go through
+    # SHA-512, not the per-process hash())
+    return random.Random("|".join(str(p) for p in parts))
@@ -0,0 +1,111 @@
+import html
+import re
+import sqlite3
+from corpus import get_connection
+from metrics import SQLITE_SECONDS, timed
+from references import BOOK_CODES, book_index
+
+# Full-text index over every verse we hold locally: whole ingested translations
+# plus any chapter fetched from bible-api.com. Lives in the corpus database.
+MARK_START, MARK_END = "\x02", "\x03" # Swapped for <mark> after HTML-escaping
+MAX_PER_PAGE = 100
+
+def init_search(conn=None):
+    conn = conn or get_connection()
+    conn.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS verse_search USING fts5(
+            text,
+            translation UNINDEXED,
+            book UNINDEXED, -- index into BOOK_CODES
+            chapter UNINDEXED,
+            verse UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    ''')
+    conn.commit()
+
+def index_translation(translation):
+    # Rebuild one translation's rows from the corpus verses table (after ingestion)
+    translation = translation.lower()
+    conn = get_connection()
+    init_search(conn)
+    with conn:
+        conn.execute("DELETE FROM verse_search WHERE translation = ?", (translation,))
+        cursor = conn.execute("INSERT INTO verse_search (text, translation, book, chapter, verse) SELECT text, translation, book, chapter, verse FROM verses WHERE translation = ?",
+                              (translation,))
+    return cursor.rowcount
+
+@timed(SQLITE_SECONDS, db="corpus")
+def index_chapter(translation, data):
+    # Incrementally (re)index one chapter from a bible-api style response
+    verses = data.get("verses") or []
+    if not verses:
+        return 0
+    book = book_index(verses[0]["book_name"])
+    if book is None:
+        return 0
+    translation = translation.lower()
+    chapter = int(verses[0]["chapter"])
+    conn = get_connection()
+    try:
+        init_search(conn)
+        with conn:
+            conn.execute("DELETE FROM verse_search WHERE translation = ? AND book = ? AND chapter = ?", (translation, book, chapter))
+            conn.executemany("INSERT INTO verse_search (text, translation, book, chapter, verse) VALUES (?, ?, ?, ?, ?)",
+                             [(v["text"].strip(), translation, book, chapter, int(v["verse"])) for v in verses])
+    except sqlite3.Error as e:
+        print(f"Search indexing failed for {translation} {verses[0]['book_name']} {chapter}: {e}")
+        return 0
+    return len(verses)
+
+def build_match_query(query):
+    # Turn free text into a safe FTS5 query: "quoted phrases" stay phrases,
+    # every other word must appear, and the last word matches as a prefix.
+    phrases = re.findall(r'"([^"]+)"', query)
+    words = re.findall(r"\w+", re.sub(r'"[^"]*"', " ", query))
+    terms = ['"' + " ".join(re.findall(r"\w+", phrase)) + '"' for phrase in phrases if re.search(r"\w", phrase)]
+    terms += [f'"{word}"' for word in words]
+    if words and not query.rstrip().endswith('"'):
+        terms[-1] += "*"
+    return " ".join(terms)
+
+def _highlight(snippet):
+    return html.escape(snippet).replace(MARK_START, "<mark>").replace(MARK_END, "</mark>")
+
+@timed(SQLITE_SECONDS, db="corpus")
+def search(query, translation=None, page=1, per_page=20):
+    match = build_match_query(query)
+    page = max(1, int(page))
+    per_page = max(1, min(MAX_PER_PAGE, int(per_page)))
+    empty = {"query": query, "total": 0, "page": page, "per_page": per_page, "results": []}
+    if not match:
+        return empty
+
+    conn = get_connection()
+    where = "verse_search MATCH ?"
+    params = [match]
+    if translation:
+        where += " AND translation = ?"
+        params.append(translation.lower())
+    try:
+        total = conn.execute(f"SELECT COUNT(*) FROM verse_search WHERE {where}", params).fetchone()[0]
+        rows = conn.execute(f"""SELECT translation, book, chapter, verse, snippet(verse_search, 0, ?, ?, '…', 24)
+                                FROM verse_search WHERE {where} ORDER BY rank LIMIT ? OFFSET ?""",
+                            [MARK_START, MARK_END] + params + [per_page, (page - 1) * per_page]).fetchall()
+    except sqlite3.OperationalError as e:
+        # No index yet (nothing ingested or fetched), or a query FTS5 rejects
+        print(f"Search failed for {query!r}: {e}")
+        return empty
+
+    results = []
+    for row_translation, book, chapter, verse, snippet in rows:
+        book_name = BOOK_CODES[book][0]
+        results.append({
+            "translation": row_translation,
+            "book_name": book_name,
+            "chapter": chapter,
+            "verse": verse,
+            "reference": f"{book_name} {chapter}:{verse}",
+            "snippet": _highlight(snippet),
+        })
+    return dict(empty, total=total, results=results)
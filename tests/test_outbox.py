@@ -0,0 +1,161 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import database
+import outbox
+from outbox import OutboxDispatcher
+from twilio_stub import StubTwilioClient
+
+# The outbox driven through StubTwilioClient, against a scratch database.
+
+class OutboxTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        database.close_connection()
+        patcher = mock.patch.object(database, "DATABASE_NAME", os.path.join(self.tmp.name, "users.db"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        rates = mock.patch.dict(outbox.RATES, sms=1000, whatsapp=1000) # Only the lease test needs a real limit
+        rates.start()
+        self.addCleanup(rates.stop)
+        database.init_db()
+
+    def tearDown(self):
+        database.close_connection()
+        self.tmp.cleanup()
+
+    def enqueue_sms(self, count):
+        for i in range(count):
+            outbox.enqueue(f"+1555000{i:04d}", "sms", body=f"Verse {i}")
+
+    def rows(self):
+        return database.get_connection().execute("SELECT status, attempts, next_attempt_at FROM outbox ORDER BY id").fetchall()
+
+    def wait_for_outbox(self, timeout=20):
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            counts = database.get_outbox_counts()
+            if not counts.get("pending") and not counts.get("sending"):
+                return counts
+            time.sleep(0.05)
+        self.fail(f"Outbox not drained: {database.get_outbox_counts()}")
+
+class IdempotencyTest(OutboxTestCase):
+    def test_same_user_channel_and_day_is_queued_once(self):
+        self.assertTrue(outbox.enqueue("+15550000001", "sms", body="John 3:16"))
+        self.assertFalse(outbox.enqueue("+15550000001", "sms", body="John 3:16"))
+        self.assertTrue(outbox.enqueue("+15550000001", "whatsapp_text", body="John 3:16"))
+        client = StubTwilioClient()
+        self.assertEqual(OutboxDispatcher(client=client).drain(), 2)
+        self.assertEqual(len(client.sent), 2)
+        # Re-running the day's bucket after it was sent doesn't send again
+        self.assertFalse(outbox.enqueue("+15550000001", "sms", body="John 3:16"))
+        self.assertEqual(OutboxDispatcher(client=client).drain(), 0)
+        self.assertEqual(len(client.sent), 2)
+
+class RetryTest(OutboxTestCase):
+    def test_transient_failure_is_retried_with_backoff(self):
+        self.enqueue_sms(1)
+        dispatcher = OutboxDispatcher(client=StubTwilioClient(failure_rate=1.0, failure_status=503))
+        with mock.patch.object(outbox, "OUTBOX_RETRY_BASE_SECONDS", 60):
+            before = time.time()
+            self.assertEqual(dispatcher.drain(), 1) # The retry isn't due yet, so drain stops
+        status, attempts, next_attempt_at = self.rows()[0]
+        self.assertEqual((status, attempts), ("pending", 1))
+        self.assertGreaterEqual(next_attempt_at, before + 60)
+        self.assertEqual(dispatcher.stats["retried"], 1)
+
+    def test_backoff_doubles_per_attempt(self):
+        self.enqueue_sms(1)
+        dispatcher = OutboxDispatcher(client=StubTwilioClient(failure_rate=1.0, failure_status=429))
+        with mock.patch.object(outbox, "OUTBOX_RETRY_BASE_SECONDS", 60):
+            for attempt in (1, 2, 3):
+                with database.get_connection() as conn:
+                    conn.execute("UPDATE outbox SET next_attempt_at = 0") # Due now
+                before = time.time()
+                dispatcher.run_once()
+                status, attempts, next_attempt_at = self.rows()[0]
+                self.assertEqual((status, attempts), ("pending", attempt))
+                self.assertAlmostEqual(next_attempt_at - before, 60 * 2 ** (attempt - 1), delta=1)
+
+    def test_retry_then_success(self):
+        self.enqueue_sms(1)
+        client = StubTwilioClient(failure_rate=1.0, failure_status=503)
+        dispatcher = OutboxDispatcher(client=client)
+        with mock.patch.object(outbox, "OUTBOX_RETRY_BASE_SECONDS", 0):
+            dispatcher.run_once()
+            client.failure_rate = 0.0
+            dispatcher.drain()
+        self.assertEqual(self.rows()[0][:2], ("sent", 2))
+        self.assertEqual(len(client.sent), 1)
+
+class DeadLetterTest(OutboxTestCase):
+    def test_permanent_failure_is_not_retried(self):
+        self.enqueue_sms(1)
+        dispatcher = OutboxDispatcher(client=StubTwilioClient(failure_rate=1.0, failure_status=400))
+        dispatcher.drain()
+        self.assertEqual(self.rows()[0][:2], ("dead", 1))
+        self.assertEqual(dispatcher.stats, {"sent": 0, "retried": 0, "dead": 1, "lost_lease": 0})
+        error = database.get_connection().execute("SELECT last_error FROM outbox").fetchone()[0]
+        self.assertIn("Simulated Twilio failure", error)
+
+    def test_gives_up_after_max_attempts(self):
+        self.enqueue_sms(1)
+        dispatcher = OutboxDispatcher(client=StubTwilioClient(failure_rate=1.0, failure_status=503))
+        with mock.patch.object(outbox, "OUTBOX_RETRY_BASE_SECONDS", 0), mock.patch.object(outbox, "OUTBOX_MAX_ATTEMPTS", 3):
+            dispatcher.drain()
+        self.assertEqual(self.rows()[0][:2], ("dead", 3))
+        self.assertEqual((dispatcher.stats["retried"], dispatcher.stats["dead"]), (2, 1))
+
+class LeaseTest(OutboxTestCase):
+    def test_expired_lease_is_reclaimed(self):
+        # A worker that claimed the row and died leaves it 'sending'
+        self.enqueue_sms(1)
+        self.assertEqual(len(database.claim_deliveries(outbox.CLAIM_BATCH, 0)), 1)
+        client = StubTwilioClient()
+        self.assertEqual(OutboxDispatcher(client=client).drain(), 1)
+        self.assertEqual(self.rows()[0][:2], ("sent", 2))
+        self.assertEqual(len(client.sent), 1)
+
+    def test_live_lease_is_not_reclaimed(self):
+        self.enqueue_sms(1)
+        database.claim_deliveries(outbox.CLAIM_BATCH, 60)
+        client = StubTwilioClient()
+        self.assertEqual(OutboxDispatcher(client=client).drain(), 0)
+        self.assertEqual(client.sent, [])
+
+    def test_stale_claim_is_not_sent(self):
+        # The first claim's lease ran out and another worker reclaimed the row
+        self.enqueue_sms(1)
+        [stale] = database.claim_deliveries(outbox.CLAIM_BATCH, 0)
+        database.claim_deliveries(outbox.CLAIM_BATCH, 60)
+        client = StubTwilioClient()
+        dispatcher = OutboxDispatcher(client=client)
+        self.assertFalse(dispatcher.process(stale))
+        self.assertEqual(client.sent, [])
+        self.assertEqual(dispatcher.stats["lost_lease"], 1)
+        self.assertEqual(self.rows()[0][:2], ("sending", 2))
+
+    def test_rows_waiting_on_the_rate_limit_are_sent_once(self):
+        # Each worker claims a whole batch but may only send 4/s, so the back of
+        # the batch outlives its 1s lease and the other worker reclaims it
+        client = StubTwilioClient()
+        self.enqueue_sms(12)
+        with mock.patch.dict(outbox.RATES, sms=4), mock.patch.object(outbox, "OUTBOX_LEASE_SECONDS", 1):
+            dispatchers = [OutboxDispatcher(client=client, workers=1, poll_seconds=0.05) for _ in range(2)]
+            for dispatcher in dispatchers:
+                dispatcher.start()
+            counts = self.wait_for_outbox()
+            for dispatcher in dispatchers:
+                dispatcher.stop()
+        self.assertEqual(counts, {"sent": 12})
+        self.assertEqual(len(client.sent), 12)
+        self.assertEqual(len({kwargs["to"] for _, kwargs in client.sent}), 12)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,48 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from references import InvalidReference, normalize_verse_preference, parse_reference
+
+class ParseReferenceTest(unittest.TestCase):
+    def test_canonical_form(self):
+        self.assertEqual(str(parse_reference("jn 3:16", "kjv")), "John 3:16")
+        self.assertEqual(str(parse_reference("1 john 4.8-9", "web")), "1 John 4:8-9")
+        self.assertEqual(str(parse_reference("Jude 3", "kjv")), "Jude 1:3")
+
+    def test_kjv_verse_bounds(self):
+        with self.assertRaises(InvalidReference):
+            parse_reference("3 John 1:15", "kjv")
+        with self.assertRaises(InvalidReference):
+            parse_reference("John 3:99")
+
+    def test_verses_other_versifications_have(self):
+        # Not in the KJV table, but real verses in these translations
+        self.assertEqual(str(parse_reference("3 John 1:15", "web")), "3 John 1:15")
+        self.assertEqual(str(parse_reference("Rev 12:18", "web")), "Revelation 12:18")
+        self.assertEqual(str(parse_reference("Psalm 3:9", "bkr")), "Psalms 3:9")
+        self.assertEqual(str(parse_reference("Psalm 3:9", "dra")), "Psalms 3:9")
+
+    def test_books_and_chapters_still_checked(self):
+        with self.assertRaises(InvalidReference):
+            parse_reference("John 22:1", "web")
+        with self.assertRaises(InvalidReference):
+            parse_reference("Genesis 1:1", "ylt")
+        with self.assertRaises(InvalidReference):
+            parse_reference("Psalm 3:0", "bkr")
+
+    def test_vulgate_names(self):
+        self.assertEqual(str(parse_reference("4 Regum 2:1", "clementine")), "2 Kings 2:1")
+        with self.assertRaises(InvalidReference):
+            parse_reference("4 Regum 2:1", "kjv")
+
+class VersePreferenceTest(unittest.TestCase):
+    def test_checked_against_every_translation(self):
+        self.assertEqual(normalize_verse_preference("3 John 1:15", ["web"]), "3 John 1:15")
+        with self.assertRaises(InvalidReference):
+            normalize_verse_preference("3 John 1:15", ["web", "kjv"])
+        self.assertEqual(normalize_verse_preference(" Random ", ["kjv"]), "random")
+
+if __name__ == "__main__":
+    unittest.main()
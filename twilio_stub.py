@@ -0,0 +1,44 @@
+import itertools
+import random
+import threading
+import time
+
+# In-process stand-in for twilio.rest.Client, enough to drive the outbox
+# dispatcher without credentials or network access.
+
+class StubTwilioError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status # Same attribute TwilioRestException carries
+
+class _StubResult:
+    def __init__(self, sid):
+        self.sid = sid
+
+class _StubResource:
+    def __init__(self, client, prefix):
+        self._client = client
+        self._prefix = prefix
+
+    def create(self, **kwargs):
+        return self._client._record(self._prefix, kwargs)
+
+class StubTwilioClient:
+    def __init__(self, latency=0.0, failure_rate=0.0, failure_status=503):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.sent = [] # (kind, kwargs) for every accepted request
+        self.messages = _StubResource(self, "SM")
+        self.calls = _StubResource(self, "CA")
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def _record(self, prefix, kwargs):
+        if self.latency:
+            time.sleep(self.latency)
+        if random.random() < self.failure_rate:
+            raise StubTwilioError(self.failure_status, "Simulated Twilio failure")
+        with self._lock:
+            self.sent.append((prefix, kwargs))
+            return _StubResult(f"{prefix}{next(self._ids):032d}")
@@ -0,0 +1,138 @@
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from metrics import UPSTREAM_SECONDS
+from config import (BIBLE_API_URL, UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT, UPSTREAM_RETRIES,
+                    UPSTREAM_BACKOFF_SECONDS, UPSTREAM_MAX_CONCURRENCY, UPSTREAM_BREAKER_THRESHOLD,
+                    UPSTREAM_BREAKER_RESET_SECONDS)
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_BACKOFF_SECONDS = 8
+
+# Subclass RequestException so existing `except requests.exceptions.RequestException`
+# handlers keep working unchanged.
+class UpstreamError(requests.exceptions.RequestException):
+    pass
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+class CircuitBreaker:
+    # closed -> (threshold consecutive failures) -> open -> (reset timeout) -> half_open
+    # half_open lets a single trial request through; success closes, failure re-opens.
+    def __init__(self, threshold, reset_seconds):
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.failures = 0
+        self.opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self.state == "open":
+                if time.time() - self.opened_at < self.reset_seconds:
+                    return False
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "half_open":
+                if self._trial_in_flight:
+                    return False
+                self._trial_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.state = "closed"
+            self.failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self.failures >= self.threshold:
+                if self.state != "open":
+                    stats["circuit_opened"] += 1
+                self.state = "open"
+                self.opened_at = time.time()
+
+# One pooled session per process: keep-alive means one TLS handshake per
+# connection instead of one per lookup.
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=UPSTREAM_MAX_CONCURRENCY)
+_session.mount("https://", _adapter)
+_session.mount("http://", _adapter)
+_semaphore = threading.BoundedSemaphore(UPSTREAM_MAX_CONCURRENCY)
+breaker = CircuitBreaker(UPSTREAM_BREAKER_THRESHOLD, UPSTREAM_BREAKER_RESET_SECONDS)
+
+stats = {
+    "requests": 0,
+    "successes": 0,
+    "failures": 0,
+    "retries": 0,
+    "timeouts": 0,
+    "circuit_rejected": 0,
+    "circuit_opened": 0,
+    "in_flight": 0,
+}
+
+def _backoff(attempt, response=None):
+    # Honour Retry-After on 429s, otherwise exponential backoff with full jitter
+    if response is not None and response.headers.get("Retry-After", "").isdigit():
+        return min(int(response.headers["Retry-After"]), MAX_BACKOFF_SECONDS)
+    return random.uniform(0, min(MAX_BACKOFF_SECONDS, UPSTREAM_BACKOFF_SECONDS * (2 ** attempt)))
+
+def get_json(path, params=None):
+    if not breaker.allow():
+        stats["circuit_rejected"] += 1
+        raise CircuitOpenError(f"bible-api circuit is open; not calling {path}")
+
+    url = f"{BIBLE_API_URL}/{path}"
+    error = None
+    for attempt in range(UPSTREAM_RETRIES + 1):
+        if attempt:
+            stats["retries"] += 1
+        response = None
+        # Cap concurrent upstream calls so a slow upstream can't tie up every thread
+        if not _semaphore.acquire(timeout=UPSTREAM_CONNECT_TIMEOUT + UPSTREAM_READ_TIMEOUT):
+            breaker.record_failure() # Every slot stuck on a slow upstream counts as a failure
+            raise UpstreamError("Too many concurrent bible-api requests")
+        stats["requests"] += 1
+        stats["in_flight"] += 1
+        started = time.perf_counter()
+        outcome = "error"
+        try:
+            response = _session.get(url, params=params, timeout=(UPSTREAM_CONNECT_TIMEOUT, UPSTREAM_READ_TIMEOUT))
+            outcome = str(response.status_code)
+        except requests.exceptions.Timeout as e:
+            stats["timeouts"] += 1
+            outcome = "timeout"
+            error = e
+        except requests.exceptions.ConnectionError as e:
+            error = e
+        finally:
+            UPSTREAM_SECONDS.observe(time.perf_counter() - started, outcome=outcome)
+            stats["in_flight"] -= 1
+            _semaphore.release()
+
+        if response is not None:
+            if response.status_code not in RETRY_STATUSES:
+                # The upstream answered; a 404 for a bad reference is not an outage
+                breaker.record_success()
+                response.raise_for_status()
+                stats["successes"] += 1
+                return response.json()
+            error = requests.exceptions.HTTPError(f"{response.status_code} from bible-api for {path}", response=response)
+        if attempt < UPSTREAM_RETRIES:
+            time.sleep(_backoff(attempt, response))
+
+    stats["failures"] += 1
+    breaker.record_failure()
+    raise UpstreamError(f"bible-api request failed after {UPSTREAM_RETRIES + 1} attempts: {error}")
+
+def upstream_stats():
+    return dict(stats, circuit_state=breaker.state, consecutive_failures=breaker.failures)